@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017-2019 Random.Zebra (https://github.com/random-zebra/)
+# Distributed under the MIT software license, see the accompanying
+# file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
+
+"""
+Microbenchmark of the base58 codec in src/pivx_b58.py against the previous implementation.
+Usage (from the PET4L directory):
+    python3 contrib/bench/bench_b58.py [--counts 10000 100000]
+"""
+import argparse
+import os
+import sys
+from hashlib import sha256
+from time import perf_counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+
+import pivx_b58  # noqa: E402
+
+B58_CHARS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+MAGIC_BYTE = 30
+
+
+# --- previous implementation (quadratic: power of the base and string/bytes prepend per digit)
+def legacy_b58encode(v):
+    long_value = 0
+    for (i, c) in enumerate(v[::-1]):
+        long_value += (256 ** i) * c
+
+    result = ''
+    while long_value >= 58:
+        div, mod = divmod(long_value, 58)
+        result = B58_CHARS[mod] + result
+        long_value = div
+    result = B58_CHARS[long_value] + result
+    nPad = 0
+    for c in v:
+        if c == 0:
+            nPad += 1
+        else:
+            break
+
+    return (B58_CHARS[0] * nPad) + result
+
+
+def legacy_b58decode(v):
+    long_value = 0
+    for (i, c) in enumerate(v[::-1]):
+        long_value += B58_CHARS.find(c) * (58 ** i)
+
+    result = bytes()
+    while long_value >= 256:
+        div, mod = divmod(long_value, 256)
+        result = bytes([mod]) + result
+        long_value = div
+    result = bytes([long_value]) + result
+
+    nPad = 0
+    for c in v:
+        if c == B58_CHARS[0]:
+            nPad += 1
+        else:
+            break
+
+    return bytes(nPad) + result
+
+
+def legacy_check(address):
+    addr_bin = legacy_b58decode(address)
+    return addr_bin[-4:] == sha256(sha256(addr_bin[0:-4]).digest()).digest()[0:4]
+
+
+def random_addresses_data(count):
+    data = []
+    for _ in range(count):
+        payload = bytes([MAGIC_BYTE]) + os.urandom(20)
+        data.append(payload + sha256(sha256(payload).digest()).digest()[:4])
+    return data
+
+
+def bench(label, fun, items):
+    start = perf_counter()
+    for x in items:
+        fun(x)
+    elapsed = perf_counter() - start
+    print("  %-28s %8.3f s  %12.0f ops/s" % (label, elapsed, len(items) / elapsed))
+    return elapsed
+
+
+def run(count):
+    print("%d addresses" % count)
+    data = random_addresses_data(count)
+    addresses = [pivx_b58.b58encode(d) for d in data]
+
+    # results must match the previous implementation
+    assert addresses == [legacy_b58encode(d) for d in data]
+    assert [pivx_b58.b58decode(a) for a in addresses] == [legacy_b58decode(a) for a in addresses]
+
+    old = bench("b58encode (legacy)", legacy_b58encode, data)
+    new = bench("b58encode", pivx_b58.b58encode, data)
+    print("  %-28s %8.1fx" % ("speedup", old / new))
+    old = bench("b58decode (legacy)", legacy_b58decode, addresses)
+    new = bench("b58decode", pivx_b58.b58decode, addresses)
+    print("  %-28s %8.1fx" % ("speedup", old / new))
+    old = bench("checksum check (legacy)", legacy_check, addresses)
+    pivx_b58.b58check_verify.cache_clear()
+    new = bench("b58check_verify (cold)", pivx_b58.b58check_verify, addresses)
+    print("  %-28s %8.1fx" % ("speedup", old / new))
+    # re-check the most recent addresses (the ones that fit in the cache)
+    recent = addresses[-pivx_b58.B58CHECK_CACHE_SIZE:]
+    old = bench("checksum check (legacy)", legacy_check, recent)
+    new = bench("b58check_verify (cached)", pivx_b58.b58check_verify, recent)
+    print("  %-28s %8.1fx" % ("speedup", old / new))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PET4L base58 benchmark')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000],
+                        help='number of addresses for each run')
+    args = parser.parse_args()
+    for n in args.counts:
+        run(n)
@@ -4,41 +4,342 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from copy import deepcopy
+from decimal import Decimal
+import threading
+from time import time, perf_counter
+
 from blockbookClient import BlockBookClient
 from cryptoIDClient import CryptoIDClient
 
-from misc import getCallerName, getFunctionName, printException, printError
+from constants import API_CACHE_TTL, API_BREAKER_THRESHOLD, API_BREAKER_COOLDOWN, API_HEDGED_REQUESTS, \
+    API_HEDGE_DELAY, API_WORKERS, blockbook_Servers, blockbook_Servers_testnet
+from misc import getCallerName, getFunctionName, printException, printError, printDbg
 
 
 def process_api_exceptions(func):
     def process_api_exceptions_int(*args, **kwargs):
-        client = args[0]
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            message = "Primary API source not responding. Trying secondary"
-            printException(getCallerName(True), getFunctionName(True), message, str(e))
-            try:
-                client.api = CryptoIDClient(client.isTestnet)
-                return func(*args, **kwargs)
-
-            except Exception as e:
-                printError(getCallerName(True), getFunctionName(True), str(e))
-                return None
+            printError(getCallerName(True), getFunctionName(True), str(e))
+            return None
 
     return process_api_exceptions_int
 
 
+def use_api_cache(func=None, persist=True):
+    '''
+    With persist=False the responses are cached in memory only (e.g. the ones keyed by xpub,
+    which must not end up in the database)
+    '''
+    if func is None:
+        return lambda f: use_api_cache(f, persist)
+
+    def use_api_cache_int(*args, **kwargs):
+        client = args[0]
+        address = args[1]
+        key = ("testnet" if client.isTestnet else "mainnet", func.__name__, address)
+        data = client.getCached(key, persist)
+        if data is None:
+            data = func(*args, **kwargs)
+            if data is not None:
+                client.setCached(key, data, persist)
+        # callers are free to modify the returned objects
+        return deepcopy(data)
+
+    return use_api_cache_int
+
+
+def consistentResponses(method, res1, res2):
+    # compare two answers of different explorers (in the format returned by the clients)
+    try:
+        if method == "getBalance":
+            return Decimal(str(res1)) == Decimal(str(res2))
+        if method in ("getAddressUtxos", "getXpubUtxos"):
+            return set((u["txid"], u["vout"]) for u in res1) == set((u["txid"], u["vout"]) for u in res2)
+        if method == "getXpubBalances":
+            return {a: Decimal(v["balance"]) for a, v in res1.items()} == \
+                {a: Decimal(v["balance"]) for a, v in res2.items()}
+        return res1 == res2
+    except Exception:
+        return False
+
+
+class ApiBackend:
+    """
+    Explorer client with health statistics and a circuit breaker:
+    closed (in use) --> open (skipped) after API_BREAKER_THRESHOLD consecutive failures
+    open --> half-open (single probe request) after API_BREAKER_COOLDOWN seconds
+    half-open --> closed (probe succeeded) or open (probe failed)
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    # weight of the last request in the rolling latency/error averages
+    ALPHA = 0.2
+    # assumed latency (seconds) of a backend not used yet
+    DEFAULT_LATENCY = 1.0
+    # number of latency samples kept to compute the hedging threshold
+    SAMPLES = 50
+
+    def __init__(self, name, client, priority=0):
+        self.name = name
+        self.client = client
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = 0
+        self.latency = None
+        self.errorRate = 0.0
+        self.lastFailure = 0
+        self.lastUsed = 0
+        self.samples = deque(maxlen=self.SAMPLES)
+
+    def hedgeDelay(self):
+        # p95 of the recent latencies
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < 5:
+            return API_HEDGE_DELAY
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def score(self):
+        # lower is better: rolling latency penalized by the rolling error rate.
+        # The error rate halves every API_BREAKER_COOLDOWN seconds without failures,
+        # so that a transient failure doesn't demote the backend for good.
+        latency = self.DEFAULT_LATENCY if self.latency is None else self.latency
+        errorRate = self.errorRate * 0.5 ** ((time() - self.lastFailure) / API_BREAKER_COOLDOWN)
+        return latency * (1 + 4 * errorRate)
+
+    def isAvailable(self):
+        # only one probe request is let through when half-open
+        with self.lock:
+            if self.state == self.OPEN and time() - self.openedAt >= API_BREAKER_COOLDOWN:
+                printDbg("API: %s half-open" % self.name)
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def onSuccess(self, elapsed):
+        with self.lock:
+            self.latency = elapsed if self.latency is None else \
+                (1 - self.ALPHA) * self.latency + self.ALPHA * elapsed
+            self.samples.append(elapsed)
+            self.errorRate *= (1 - self.ALPHA)
+            self.lastUsed = time()
+            self.failures = 0
+            if self.state != self.CLOSED:
+                printDbg("API: %s closed" % self.name)
+            self.state = self.CLOSED
+
+    def onFailure(self):
+        with self.lock:
+            self.errorRate = (1 - self.ALPHA) * self.errorRate + self.ALPHA
+            self.lastFailure = self.lastUsed = time()
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= API_BREAKER_THRESHOLD:
+                printDbg("API: %s open" % self.name)
+                self.state = self.OPEN
+                self.openedAt = time()
+
+
+class ApiCall:
+    """
+    Request sent to a backend through the executor.
+    started is set (and startTime recorded) when a worker actually runs it, so that the time spent
+    waiting in the executor queue isn't counted as latency of the backend.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.started = threading.Event()
+        self.startTime = None
+
+    def start(self):
+        self.startTime = perf_counter()
+        self.started.set()
+
+    def elapsed(self):
+        return perf_counter() - self.startTime
+
+
 class ApiClient:
 
-    def __init__(self, isTestnet=False):
+    def __init__(self, isTestnet=False, db=None, ttl=API_CACHE_TTL, hedge=API_HEDGED_REQUESTS):
         self.isTestnet = isTestnet
-        self.api = BlockBookClient(isTestnet)
+        self.hedge = hedge
+        self.executor = ThreadPoolExecutor(max_workers=API_WORKERS)
+        # pool of explorer backends (in order of preference)
+        self.backends = []
+        for url in (blockbook_Servers_testnet if isTestnet else blockbook_Servers):
+            self.backends.append(ApiBackend(url, BlockBookClient(url, isTestnet), len(self.backends)))
+        if not isTestnet:
+            self.backends.append(ApiBackend("CryptoID", CryptoIDClient(isTestnet), len(self.backends)))
+        # responses cache: (network, endpoint, address) --> (lastfetch, data)
+        # with an optional on-disk tier in the app database
+        self.db = db
+        self.ttl = ttl
+        self.cache = {}
+        self.cacheLock = threading.Lock()
+
+    def getCached(self, key, persist=True):
+        minTime = time() - self.ttl
+        with self.cacheLock:
+            item = self.cache.get(key)
+        if item is not None and item[0] >= minTime:
+            return item[1]
+        if persist and self.db is not None:
+            item = self.db.getApiCache(*key, minTime)
+            if item is not None:
+                with self.cacheLock:
+                    self.cache[key] = (item[1], item[0])
+                return item[0]
+        return None
+
+    def setCached(self, key, data, persist=True):
+        self.setCachedItems([(key, data)], persist)
+
+    def setCachedItems(self, items, persist=True):
+        now = time()
+        with self.cacheLock:
+            for key, data in items:
+                self.cache[key] = (now, data)
+        if persist and self.db is not None:
+            with self.db.session():
+                for key, data in items:
+                    self.db.addApiCache(*key, data, now)
+
+    def close(self):
+        # no new requests are accepted. The worker threads exit once the queued ones are done
+        self.executor.shutdown(wait=False)
+
+    def invalidateCache(self):
+        printDbg("Clearing explorer cache")
+        with self.cacheLock:
+            self.cache.clear()
+        if self.db is not None:
+            self.db.clearApiCache()
+
+    def getBackends(self, method):
+        # backends implementing method, healthiest first
+        backends = [b for b in self.backends if hasattr(b.client, method)]
+        backends.sort(key=lambda b: (b.score(), b.priority))
+        # preferred backends left unused for a while are tried first, to refresh their stats
+        # (e.g. the primary explorer is back after a failure)
+        if len(backends) > 0:
+            now = time()
+            stale = [b for b in backends if b.priority < backends[0].priority and
+                     now - b.lastUsed >= API_BREAKER_COOLDOWN]
+            backends = stale + [b for b in backends if b not in stale]
+        return backends
+
+    def callBackend(self, call, method, args):
+        b = call.backend
+        call.start()
+        try:
+            res = getattr(b.client, method)(*args)
+            if res is None:
+                raise Exception("Invalid response")
+        except Exception as e:
+            b.onFailure()
+            message = "%s not responding to %s" % (b.name, method)
+            printException(getCallerName(), getFunctionName(), message, str(e))
+            raise
+        b.onSuccess(call.elapsed())
+        return res
+
+    def request(self, method, *args):
+        backends = iter(self.getBackends(method))
+        pending = {}
+
+        def launch():
+            for b in backends:
+                if b.isAvailable():
+                    call = ApiCall(b)
+                    pending[self.executor.submit(self.callBackend, call, method, args)] = call
+                    return True
+            return False
+
+        launch()
+        canHedge = self.hedge
+        while len(pending) > 0:
+            timeout = None
+            if canHedge and len(pending) == 1:
+                # the hedging delay runs from the start of the call (not from the submission)
+                call = next(iter(pending.values()))
+                call.started.wait()
+                timeout = max(0, call.backend.hedgeDelay() - call.elapsed())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if len(done) == 0:
+                # slow answer: send the same request to the next backend. First valid answer wins.
+                printDbg("API: %s is slow on %s. Hedging." % (next(iter(pending.values())).backend.name, method))
+                canHedge = launch()
+                continue
+            for f in done:
+                b = pending.pop(f).backend
+                if f.exception() is not None:
+                    continue
+                res = f.result()
+                # compare with the late answer of the hedged request
+                for other in pending:
+                    other.add_done_callback(lambda f2, b2=pending[other].backend:
+                                            self.crossCheck(method, args, b, res, b2, f2))
+                return res
+            if len(pending) == 0:
+                # all requests failed: try the next backend
+                canHedge = self.hedge
+                launch()
+
+        raise Exception("No explorer available for %s" % method)
+
+    def crossCheck(self, method, args, b1, res1, b2, future):
+        if future.exception() is not None:
+            return
+        if not consistentResponses(method, res1, future.result()):
+            printError(getCallerName(), getFunctionName(),
+                       "%s and %s returned different %s for %s" % (b1.name, b2.name, method, args[0]))
 
     @process_api_exceptions
+    @use_api_cache
     def getAddressUtxos(self, address):
-        return self.api.getAddressUtxos(address)
+        return self.request("getAddressUtxos", address)
 
     @process_api_exceptions
+    @use_api_cache
     def getBalance(self, address):
-        return self.api.getBalance(address)
+        return self.request("getBalance", address)
+
+    @use_api_cache(persist=False)
+    def getXpubBalances(self, xpub):
+        return self.request("getXpubBalances", xpub)
+
+    @use_api_cache(persist=False)
+    def getXpubUtxos(self, xpub):
+        return self.request("getXpubUtxos", xpub)
+
+    def scanAccount(self, xpub):
+        '''
+        Fetches balances and utxos of all the addresses of an account with two xpub requests, and
+        caches them per address (so that getBalance/getAddressUtxos don't hit the explorer).
+        Returns a dict address --> {'path', 'balance'} or None if the explorer can't scan xpubs.
+        '''
+        try:
+            balances = self.getXpubBalances(xpub)
+            utxos = self.getXpubUtxos(xpub)
+        except Exception as e:
+            printError(getCallerName(), getFunctionName(), "Unable to scan account: %s" % str(e))
+            return None
+        network = "testnet" if self.isTestnet else "mainnet"
+        addr_utxos = {address: [] for address in balances}
+        for u in utxos:
+            addr_utxos.setdefault(u.get("address"), []).append(u)
+        items = []
+        for address in balances:
+            items.append(((network, "getBalance", address), balances[address]["balance"]))
+            items.append(((network, "getAddressUtxos", address), addr_utxos[address]))
+        self.setCachedItems(items)
+        return balances
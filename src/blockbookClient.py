@@ -4,53 +4,34 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from decimal import Decimal
 import requests
 
-from misc import getCallerName, getFunctionName, printException
+from constants import API_REQUEST_TIMEOUT
 
 
-def process_blockbook_exceptions(func):
-    def process_blockbook_exceptions_int(*args, **kwargs):
-        client = args[0]
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            if client.isTestnet:
-                new_url = "https://testnet.fuzzbawls.pw"
-            else:
-                new_url = "https://zkbitcoin.com/"
-            message = "BlockBook Client exception on %s\nTrying backup server %s" % (client.url, new_url)
-            printException(getCallerName(True), getFunctionName(True), message, str(e))
-            try:
-                client.url = new_url
-                return func(*args, **kwargs)
-
-            except Exception:
-                raise
-
-    return process_blockbook_exceptions_int
+def satoshisToPiv(satoshis):
+    # plain decimal notation (no exponent), without trailing zeros: e.g. "0", "0.0000001", "12.5"
+    amount = format((Decimal(satoshis) / 100000000).quantize(Decimal('0.00000001')), 'f')
+    return amount.rstrip('0').rstrip('.') if '.' in amount else amount
 
 
 class BlockBookClient:
 
-    def __init__(self, isTestnet=False):
+    def __init__(self, url, isTestnet=False):
         self.isTestnet = isTestnet
-        if isTestnet:
-            self.url = "https://testnet.rockdev.org/"
-        else:
-            self.url = "https://explorer.rockdev.org/"
+        self.url = url
 
-    def checkResponse(self, method, param=""):
+    def checkResponse(self, method, param="", query=None):
         url = self.url + "/api/%s" % method
         if param != "":
             url += "/%s" % param
-        resp = requests.get(url, data={}, verify=True)
+        resp = requests.get(url, params=query, data={}, verify=True, timeout=API_REQUEST_TIMEOUT)
         if resp.status_code == 200:
             data = resp.json()
             return data
         raise Exception("Invalid response")
 
-    @process_blockbook_exceptions
     def getAddressUtxos(self, address):
         utxos = self.checkResponse("utxo", address)
         # Add script for cryptoID legacy
@@ -58,6 +39,24 @@ class BlockBookClient:
             u["script"] = ""
         return utxos
 
-    @process_blockbook_exceptions
     def getBalance(self, address):
-        return self.checkResponse("address", address)["balance"]
+        # basic details only: skip the (unbounded) list of txids of the address
+        data = self.checkResponse("v2/address", address, {'details': 'basic'})
+        # v2 api returns satoshis
+        return satoshisToPiv(data["balance"])
+
+    def getXpubBalances(self, xpub):
+        # derived addresses (used or not, up to the explorer gap limit) of the account
+        data = self.checkResponse("v2/xpub", xpub, {'details': 'tokenBalances', 'tokens': 'derived'})
+        balances = {}
+        for t in data.get("tokens", []):
+            balances[t["name"]] = {"path": t.get("path"), "balance": satoshisToPiv(t.get("balance", "0"))}
+        return balances
+
+    def getXpubUtxos(self, xpub):
+        utxos = self.checkResponse("v2/utxo", xpub)
+        # Convert to the format of the per-address (v1) api
+        for u in utxos:
+            u["satoshis"] = int(u["value"])
+            u["script"] = ""
+        return utxos
@@ -20,10 +20,34 @@ STAKE_MAGIC_BYTE = 63
 TESTNET_WIF_PREFIX = 239
 TESTNET_MAGIC_BYTE = 139
 TESTNET_STAKE_MAGIC_BYTE = 73
+XPUB_PREFIX = 0x022D2533
+TESTNET_XPUB_PREFIX = 0x3a8061a0
 DEFAULT_PROTOCOL_VERSION = 70915
 MINIMUM_FEE = 0.0001    # minimum PIV/kB
 SECONDS_IN_2_MONTHS = 60 * 24 * 60 * 60
 MAX_INPUTS_NO_WARNING = 75
+RPC_KEEPALIVE_TIMEOUT = 15    # seconds before an idle RPC connection is re-opened
+RPC_PROBE_INTERVAL = 60    # seconds between two latency probes of all the RPC servers
+RPC_PROBE_WORKERS = 8    # max number of RPC servers probed concurrently
+RPC_PROBE_SAMPLES = 10    # latency samples kept for each RPC server
+RPC_SWITCH_MARGIN = 1.25    # auto-select keeps the current server unless another is this much faster
+BLOCK_WAIT_TIMEOUT = 600    # seconds of a single wait for a new block (zmq or waitfornewblock long-poll)
+BLOCK_POLL_INTERVAL = 120    # seconds between two block checks when no notification is available
+RPC_WATCHED_INTERVAL = 600    # seconds between two RPC watchdog checks while the block watcher is active
+RPC_BATCH_SIZE = 100    # max number of calls in a single JSON-RPC batch request
+B58CHECK_CACHE_SIZE = 4096    # base58check validations kept in memory
+PARSED_TXES_CACHE_SIZE = 256    # decoded transactions kept in memory
+DB_CACHE_SIZE = 8192    # KiB of page cache for the database connection
+DB_MAX_VARIABLES = 500  # max number of parameters bound to a single SQL query
+DB_VACUUM_THRESHOLD = 0.25    # compact the database when more than 25% of its pages are free
+API_CACHE_TTL = 60    # seconds before a cached explorer response is fetched again
+API_REQUEST_TIMEOUT = 10    # seconds before an explorer request is considered failed
+API_BREAKER_THRESHOLD = 3    # consecutive failures that open the circuit of an explorer backend
+API_BREAKER_COOLDOWN = 30    # seconds before an open circuit lets a probe request through
+API_HEDGED_REQUESTS = False   # send a second request to another explorer when the first one is slow
+API_HEDGE_DELAY = 1.0    # seconds before hedging, until enough latency samples are collected
+API_WORKERS = 16    # max number of concurrent explorer requests
+BALANCE_WORKERS = 8    # max number of concurrent balance requests when loading the addresses
 starting_width = 1033
 starting_height = 585
 home_dir = os.path.expanduser('~')
@@ -44,7 +68,11 @@ DefaultCache = {
     "hwAcc": 0,
     "spathFrom": 0,
     "spathTo": 10,
-    "intExt": 0
+    "intExt": 0,
+    "autoSelectRPC": False,
+    "feePerKb": MINIMUM_FEE,
+    "feeHeight": 0,
+    "scanAccount": False
 }
 
 trusted_RPC_Servers = [
@@ -53,6 +81,10 @@ trusted_RPC_Servers = [
     ["https", "charlotte.fuzzbawls.pw:8080", "spmtUser", "ZyD936tm9dvqmMP8A777"]]
 
 
+blockbook_Servers = ["https://explorer.rockdev.org/", "https://zkbitcoin.com/"]
+blockbook_Servers_testnet = ["https://testnet.rockdev.org/", "https://testnet.fuzzbawls.pw"]
+
+
 HW_devices = [
     # (model name, api index)
     ("LEDGER Nano", 0),
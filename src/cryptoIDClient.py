@@ -7,6 +7,7 @@
 from random import choice
 import requests
 
+from constants import API_REQUEST_TIMEOUT
 from misc import getCallerName, getFunctionName, printException
 
 api_keys = ["b62b40b5091e", "f1d66708a077", "ed85c85c0126", "ccc60d06f737"]
@@ -46,12 +47,11 @@ class CryptoIDClient:
             raise Exception("\nNo CryptoID Testnet server\n")
         self.isTestnet = False
         self.url = "http://chainz.cryptoid.info/pivx/api.dws"
-        self.parameters = {}
 
     def checkResponse(self, parameters):
         key = choice(api_keys)
         parameters['key'] = key
-        resp = requests.get(self.url, params=parameters)
+        resp = requests.get(self.url, params=parameters, timeout=API_REQUEST_TIMEOUT)
         if resp.status_code == 200:
             data = resp.json()
             return data
@@ -59,10 +59,10 @@ class CryptoIDClient:
 
     @process_cryptoID_exceptions
     def getAddressUtxos(self, address):
-        self.parameters = {}
-        self.parameters['q'] = 'unspent'
-        self.parameters['active'] = address
-        res = self.checkResponse(self.parameters)
+        parameters = {}
+        parameters['q'] = 'unspent'
+        parameters['active'] = address
+        res = self.checkResponse(parameters)
         if res is None:
             return None
         else:
@@ -70,7 +70,7 @@ class CryptoIDClient:
 
     @process_cryptoID_exceptions
     def getBalance(self, address):
-        self.parameters = {}
-        self.parameters['q'] = 'getbalance'
-        self.parameters['a'] = address
-        return self.checkResponse(self.parameters)
+        parameters = {}
+        parameters['q'] = 'getbalance'
+        parameters['a'] = address
+        return self.checkResponse(parameters)
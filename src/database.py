@@ -5,10 +5,13 @@
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
 import logging
+import simplejson as json
 import sqlite3
 import threading
+from contextlib import contextmanager
 
-from constants import database_File, trusted_RPC_Servers
+from constants import database_File, trusted_RPC_Servers, DB_MAX_VARIABLES, DB_CACHE_SIZE, \
+    DB_VACUUM_THRESHOLD
 from misc import printDbg, getCallerName, getFunctionName, printException
 
 
@@ -21,9 +24,11 @@ class Database:
         printDbg("DB: Initializing...")
         self.app = app
         self.file_name = database_File
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
         self.isOpen = False
         self.conn = None
+        self.sessionDepth = 0
+        self.sessionFailed = False
         printDbg("DB: Initialized")
 
     def openDB(self):
@@ -34,12 +39,10 @@ class Database:
         with self.lock:
             try:
                 if self.conn is None:
-                    self.conn = sqlite3.connect(self.file_name)
+                    self.connect()
 
                 self.initTables()
                 self.conn.commit()
-                self.conn.close()
-                self.conn = None
                 self.isOpen = True
                 printDbg("DB: Database open")
 
@@ -47,6 +50,17 @@ class Database:
                 err_msg = 'SQLite initialization error'
                 printException(getCallerName(), getFunctionName(), err_msg, e)
 
+    def connect(self):
+        # single connection kept open (and shared among threads, guarded by self.lock) until close()
+        self.conn = sqlite3.connect(self.file_name, check_same_thread=False)
+        # write-ahead log: readers do not block the writer and commits only append to the log
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode, sync only at checkpoints (safe against corruption, might lose last commit on power loss)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # page cache size in KiB (negative value)
+        self.conn.execute("PRAGMA cache_size=-%d" % DB_CACHE_SIZE)
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+
     def close(self):
         printDbg("DB: closing...")
         if not self.isOpen:
@@ -72,7 +86,7 @@ class Database:
             self.lock.acquire()
             try:
                 if self.conn is None:
-                    self.conn = sqlite3.connect(self.file_name)
+                    self.connect()
                 return self.conn.cursor()
 
             except Exception as e:
@@ -83,23 +97,21 @@ class Database:
         else:
             raise Exception("Database closed")
 
-    def releaseCursor(self, rollingBack=False, vacuum=False):
+    def releaseCursor(self, rollingBack=False):
         if self.isOpen:
             try:
-                if self.conn is not None:
+                # inside a session: commit (or rollback) only when the session ends
+                if self.sessionDepth > 0:
+                    if rollingBack:
+                        self.sessionFailed = True
+
+                elif self.conn is not None:
                     # commit
                     if rollingBack:
                         self.conn.rollback()
 
                     else:
                         self.conn.commit()
-                        if vacuum:
-                            self.conn.execute('vacuum')
-
-                    # close connection
-                    self.conn.close()
-
-                self.conn = None
 
             except Exception as e:
                 err_msg = 'SQLite error releasing cursor'
@@ -111,6 +123,54 @@ class Database:
         else:
             raise Exception("Database closed")
 
+    def compact(self, threshold=DB_VACUUM_THRESHOLD):
+        '''
+        rebuilds the database file (VACUUM) only if the ratio of free pages is above threshold.
+        Deletes just leave free pages behind, so this is called only at startup (after pruning) and at shutdown
+        '''
+        if not self.isOpen:
+            raise Exception("Database closed")
+
+        with self.lock:
+            try:
+                page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+                freelist_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if page_count > 0 and freelist_count / page_count > threshold:
+                    printDbg("DB: Compacting (%d free pages out of %d)..." % (freelist_count, page_count))
+                    self.conn.commit()
+                    self.conn.execute("VACUUM")
+                    printDbg("DB: Database compacted")
+
+            except Exception as e:
+                err_msg = 'SQLite error compacting database'
+                printException(getCallerName(), getFunctionName(), err_msg, e.args)
+
+    @contextmanager
+    def session(self):
+        '''
+        groups all the DB methods called inside the 'with' block in a single transaction.
+        Other threads are kept out until it's committed (or rolled back, if an exception is raised
+        or one of the DB methods failed)
+        '''
+        cursor = self.getCursor()
+        if self.sessionDepth == 0:
+            self.sessionFailed = False
+        self.sessionDepth += 1
+        rollingBack = False
+        try:
+            yield cursor
+
+        except Exception:
+            rollingBack = True
+            raise
+
+        finally:
+            self.sessionDepth -= 1
+            if self.sessionDepth == 0 and self.sessionFailed:
+                printDbg("DB: session failed. Rolling back")
+                rollingBack = True
+            self.releaseCursor(rollingBack=rollingBack)
+
     def initTables(self):
         printDbg("DB: Initializing tables...")
         try:
@@ -136,6 +196,19 @@ class Database:
             cursor.execute("CREATE TABLE IF NOT EXISTS RAWTXES("
                            " tx_hash TEXT PRIMARY KEY,  rawtx TEXT, lastfetch INTEGER)")
 
+            # Tables for derived addresses
+            cursor.execute("CREATE TABLE IF NOT EXISTS ADDRESSES("
+                           " fingerprint TEXT, isTestnet BOOLEAN, account INTEGER, change INTEGER,"
+                           " idx INTEGER, address TEXT,"
+                           " PRIMARY KEY (fingerprint, isTestnet, account, change, idx))")
+
+            cursor.execute("CREATE INDEX IF NOT EXISTS ADDRESSES_address ON ADDRESSES(address)")
+
+            # Tables for explorer responses
+            cursor.execute("CREATE TABLE IF NOT EXISTS API_CACHE("
+                           " network TEXT, endpoint TEXT, address TEXT, data TEXT, lastfetch INTEGER,"
+                           " PRIMARY KEY (network, endpoint, address))")
+
             printDbg("DB: Tables initialized")
 
         except Exception as e:
@@ -165,6 +238,7 @@ class Database:
     def clearTable(self, table_name):
         printDbg("DB: Clearing table %s..." % table_name)
         cleared_RPC = False
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DELETE FROM %s" % table_name)
@@ -177,14 +251,16 @@ class Database:
         except Exception as e:
             err_msg = 'error clearing %s in database' % table_name
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
 
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
             if cleared_RPC:
                 self.app.sig_changed_rpcServers.emit()
 
     def removeTable(self, table_name):
         printDbg("DB: Dropping table %s..." % table_name)
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DROP TABLE IF EXISTS %s" % table_name)
@@ -193,9 +269,10 @@ class Database:
         except Exception as e:
             err_msg = 'error removing table %s from database' % table_name
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
 
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
 
     '''
     RPC servers methods
@@ -204,6 +281,7 @@ class Database:
     def addRPCServer(self, protocol, host, user, passwd):
         printDbg("DB: Adding new RPC server...")
         added_RPC = False
+        rollingBack = False
         try:
             cursor = self.getCursor()
 
@@ -217,14 +295,16 @@ class Database:
         except Exception as e:
             err_msg = 'error adding RPC server entry to DB'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
         finally:
-            self.releaseCursor()
+            self.releaseCursor(rollingBack=rollingBack)
             if added_RPC:
                 self.app.sig_changed_rpcServers.emit()
 
     def editRPCServer(self, protocol, host, user, passwd, id):
         printDbg("DB: Editing RPC server with id %d" % id)
         changed_RPC = False
+        rollingBack = False
         try:
             cursor = self.getCursor()
 
@@ -238,8 +318,9 @@ class Database:
         except Exception as e:
             err_msg = 'error editing RPC server entry to DB'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
         finally:
-            self.releaseCursor()
+            self.releaseCursor(rollingBack=rollingBack)
             if changed_RPC:
                 self.app.sig_changed_rpcServers.emit()
 
@@ -283,6 +364,7 @@ class Database:
     def removeRPCServer(self, id):
         printDbg("DB: Remove RPC server with id %d" % id)
         removed_RPC = False
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DELETE FROM CUSTOM_RPC_SERVERS"
@@ -292,9 +374,10 @@ class Database:
         except Exception as e:
             err_msg = 'error removing RPC servers from database'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
 
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
             if removed_RPC:
                 self.app.sig_changed_rpcServers.emit()
 
@@ -323,6 +406,7 @@ class Database:
 
     def addReward(self, utxo):
         logging.debug("DB: Adding reward")
+        rollingBack = False
         try:
             cursor = self.getCursor()
 
@@ -335,12 +419,36 @@ class Database:
         except Exception as e:
             err_msg = 'error adding reward UTXO to DB'
             printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
 
         finally:
-            self.releaseCursor()
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def addRewards(self, utxos):
+        utxos = list(utxos)
+        logging.debug("DB: Adding %d rewards" % len(utxos))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+
+            cursor.executemany("INSERT OR REPLACE INTO UTXOS "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               [(utxo['txid'], utxo['vout'], utxo['satoshis'], utxo['confirmations'],
+                                 utxo['script'], utxo['receiver'], utxo['coinstake'], utxo['staker'])
+                                for utxo in utxos]
+                               )
+
+        except Exception as e:
+            err_msg = 'error adding reward UTXOs to DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
+
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
 
     def deleteReward(self, tx_hash, tx_ouput_n):
         logging.debug("DB: Deleting reward")
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DELETE FROM UTXOS WHERE tx_hash = ? AND tx_ouput_n = ?", (tx_hash, tx_ouput_n))
@@ -348,8 +456,42 @@ class Database:
         except Exception as e:
             err_msg = 'error deleting UTXO from DB'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def deleteRewards(self, utxos):
+        utxos = list(utxos)
+        logging.debug("DB: Deleting %d rewards" % len(utxos))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+            cursor.executemany("DELETE FROM UTXOS WHERE tx_hash = ? AND tx_ouput_n = ?",
+                               [(utxo['txid'], utxo['vout']) for utxo in utxos])
+
+        except Exception as e:
+            err_msg = 'error deleting UTXOs from DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def updateRewardsConfirmations(self, utxos):
+        utxos = list(utxos)
+        logging.debug("DB: Updating confirmations of %d rewards" % len(utxos))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+            cursor.executemany("UPDATE UTXOS SET confirmations = ?"
+                               " WHERE tx_hash = ? AND tx_ouput_n = ?",
+                               [(utxo['confirmations'], utxo['txid'], utxo['vout']) for utxo in utxos])
+
+        except Exception as e:
+            err_msg = 'error updating UTXOs in DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
 
     def getReward(self, tx_hash, tx_ouput_n):
         logging.debug("DB: Getting reward")
@@ -371,6 +513,31 @@ class Database:
             return self.rewards_from_rows(rows)[0]
         return None
 
+    def getRewards(self, outpoints):
+        outpoints = list(outpoints)
+        logging.debug("DB: Getting %d rewards" % len(outpoints))
+        tx_hashes = list(set(txid for txid, _ in outpoints))
+        rows = []
+        try:
+            cursor = self.getCursor()
+
+            for i in range(0, len(tx_hashes), DB_MAX_VARIABLES):
+                chunk = tx_hashes[i:i + DB_MAX_VARIABLES]
+                cursor.execute("SELECT * FROM UTXOS"
+                               " WHERE tx_hash IN (%s)" % ", ".join("?" * len(chunk)), chunk)
+                rows += cursor.fetchall()
+
+        except Exception as e:
+            err_msg = 'error getting rewards'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rows = []
+        finally:
+            self.releaseCursor()
+
+        # keep only the requested outputs, in the requested order
+        rewards = {(r['txid'], r['vout']): r for r in self.rewards_from_rows(rows)}
+        return [rewards[o] for o in outpoints if o in rewards]
+
     def getRewardsList(self, receiver=None):
         try:
             cursor = self.getCursor()
@@ -412,6 +579,7 @@ class Database:
 
     def addRawTx(self, tx_hash, rawtx, lastfetch=0):
         logging.debug("DB: Adding rawtx for %s" % tx_hash)
+        rollingBack = False
         try:
             cursor = self.getCursor()
 
@@ -423,13 +591,38 @@ class Database:
         except Exception as e:
             err_msg = 'error adding rawtx to DB'
             printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
 
         finally:
-            self.releaseCursor()
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def addRawTxes(self, rawtxes):
+        '''
+        inserts a list of (tx_hash, rawtx, lastfetch) tuples in a single transaction
+        '''
+        rawtxes = list(rawtxes)
+        logging.debug("DB: Adding %d rawtxes" % len(rawtxes))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+
+            cursor.executemany("INSERT OR REPLACE INTO RAWTXES "
+                               "VALUES (?, ?, ?)",
+                               rawtxes
+                               )
+
+        except Exception as e:
+            err_msg = 'error adding rawtxes to DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
+
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
 
 
     def deleteRawTx(self, tx_hash):
         logging.debug("DB: Deleting rawtx for %s" % tx_hash)
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DELETE FROM RAWTXES WHERE tx_hash = ?", (tx_hash, ))
@@ -437,8 +630,9 @@ class Database:
         except Exception as e:
             err_msg = 'error deleting rawtx from DB'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
 
 
     def getRawTx(self, tx_hash):
@@ -461,11 +655,33 @@ class Database:
             return self.txes_from_rows(rows)[0]
         return None
 
+    def getRawTxes(self, tx_hashes):
+        logging.debug("DB: Getting %d rawtxes" % len(tx_hashes))
+        rows = []
+        try:
+            cursor = self.getCursor()
+
+            for i in range(0, len(tx_hashes), DB_MAX_VARIABLES):
+                chunk = tx_hashes[i:i + DB_MAX_VARIABLES]
+                cursor.execute("SELECT * FROM RAWTXES"
+                               " WHERE tx_hash IN (%s)" % ", ".join("?" * len(chunk)), chunk)
+                rows += cursor.fetchall()
+
+        except Exception as e:
+            err_msg = 'error getting raw txes'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rows = []
+        finally:
+            self.releaseCursor()
+
+        return self.txes_from_rows(rows)
+
     def clearRawTxes(self, minTime):
         '''
         removes txes with lastfetch older than mintime
         '''
         printDbg("Pruning table RAWTXES")
+        rollingBack = False
         try:
             cursor = self.getCursor()
             cursor.execute("DELETE FROM RAWTXES WHERE lastfetch < ?", (minTime, ))
@@ -473,5 +689,168 @@ class Database:
         except Exception as e:
             err_msg = 'error deleting rawtx from DB'
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
+
+    """
+    addresses methods
+    """
+
+    def addresses_from_rows(self, rows):
+        addresses = []
+
+        for row in rows:
+            # fetch address item
+            addr = {}
+            addr['fingerprint'] = row[0]
+            addr['isTestnet'] = row[1]
+            addr['account'] = row[2]
+            addr['change'] = row[3]
+            addr['idx'] = row[4]
+            addr['address'] = row[5]
+            # add to list
+            addresses.append(addr)
+
+        return addresses
+
+    def addAddresses(self, fingerprint, isTestnet, account, change, addresses):
+        '''
+        inserts a list of (idx, address) tuples derived from the same chain in a single transaction
+        '''
+        addresses = list(addresses)
+        logging.debug("DB: Adding %d addresses" % len(addresses))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+
+            cursor.executemany("INSERT OR REPLACE INTO ADDRESSES "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               [(fingerprint, isTestnet, account, change, idx, address) for (idx, address) in addresses]
+                               )
+
+        except Exception as e:
+            err_msg = 'error adding addresses to DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
+
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def getAddress(self, fingerprint, isTestnet, account, change, idx):
+        logging.debug("DB: Getting address %d'/%d/%d" % (account, change, idx))
+        try:
+            cursor = self.getCursor()
+
+            cursor.execute("SELECT * FROM ADDRESSES"
+                           " WHERE fingerprint = ? AND isTestnet = ? AND account = ? AND change = ? AND idx = ?",
+                           (fingerprint, isTestnet, account, change, idx))
+            rows = cursor.fetchall()
+
+        except Exception as e:
+            err_msg = 'error getting address %d\'/%d/%d' % (account, change, idx)
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rows = []
+        finally:
+            self.releaseCursor()
+
+        if len(rows) > 0:
+            return self.addresses_from_rows(rows)[0]['address']
+        return None
+
+    def getAddressPath(self, address, fingerprint=None, isTestnet=None):
+        '''
+        returns the address item (with account, change and idx) or None if the address was never derived
+        '''
+        logging.debug("DB: Getting path of address %s" % address)
+        try:
+            cursor = self.getCursor()
+
+            query = "SELECT * FROM ADDRESSES WHERE address = ?"
+            params = [address]
+            if fingerprint is not None:
+                query += " AND fingerprint = ?"
+                params.append(fingerprint)
+            if isTestnet is not None:
+                query += " AND isTestnet = ?"
+                params.append(isTestnet)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        except Exception as e:
+            err_msg = 'error getting path of address %s' % address
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rows = []
+        finally:
+            self.releaseCursor()
+
+        if len(rows) > 0:
+            return self.addresses_from_rows(rows)[0]
+        return None
+
+    """
+    explorer cache methods
+    """
+
+    def addApiCache(self, network, endpoint, address, data, lastfetch):
+        logging.debug("DB: Caching %s response for %s" % (endpoint, address))
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+
+            cursor.execute("INSERT OR REPLACE INTO API_CACHE "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           (network, endpoint, address, json.dumps(data), lastfetch)
+                           )
+
+        except Exception as e:
+            err_msg = 'error adding api response to DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rollingBack = True
+
+        finally:
+            self.releaseCursor(rollingBack=rollingBack)
+
+    def getApiCache(self, network, endpoint, address, minTime):
+        '''
+        returns the cached response (and its fetch time) if fetched after minTime, or None
+        '''
+        logging.debug("DB: Getting cached %s response for %s" % (endpoint, address))
+        try:
+            cursor = self.getCursor()
+
+            cursor.execute("SELECT data, lastfetch FROM API_CACHE"
+                           " WHERE network = ? AND endpoint = ? AND address = ? AND lastfetch >= ?",
+                           (network, endpoint, address, minTime))
+            rows = cursor.fetchall()
+
+        except Exception as e:
+            err_msg = 'error getting cached api response for %s' % address
+            printException(getCallerName(), getFunctionName(), err_msg, e)
+            rows = []
+        finally:
+            self.releaseCursor()
+
+        if len(rows) > 0:
+            return json.loads(rows[0][0]), rows[0][1]
+        return None
+
+    def clearApiCache(self, minTime=None):
+        '''
+        removes the responses fetched earlier than minTime (all of them if minTime is None)
+        '''
+        printDbg("Pruning table API_CACHE")
+        rollingBack = False
+        try:
+            cursor = self.getCursor()
+            if minTime is None:
+                cursor.execute("DELETE FROM API_CACHE")
+            else:
+                cursor.execute("DELETE FROM API_CACHE WHERE lastfetch < ?", (minTime, ))
+
+        except Exception as e:
+            err_msg = 'error deleting api responses from DB'
+            printException(getCallerName(), getFunctionName(), err_msg, e.args)
+            rollingBack = True
         finally:
-            self.releaseCursor(vacuum=True)
+            self.releaseCursor(rollingBack=rollingBack)
@@ -5,13 +5,15 @@
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
 import logging
+import threading
 
+from bitcoin import bin_hash160
 from PyQt5.QtCore import QObject, pyqtSignal
 
 from constants import HW_devices
 from ledgerClient import LedgerApi
 from misc import printOK, printDbg
-from time import sleep
+from pivx_hashlib import bip32_ckd_pub, bip32_serialize_pub, pubkey_to_address
 from trezorClient import TrezorApi
 
 
@@ -35,6 +37,9 @@ class HWdevice(QObject):
         QObject.__init__(self, *args, **kwargs)
         self.main_wnd = main_wnd
         self.api = None
+        # public nodes (pubkey, chaincode): (account, isTestnet) from the device, (account, intExt, isTestnet) derived
+        self.nodes = {}
+        self.nodesLock = threading.Lock()
         printOK("HW: Class initialized")
 
     def initDevice(self, hw_index):
@@ -42,6 +47,8 @@ class HWdevice(QObject):
         if hw_index >= len(HW_devices):
             raise Exception("Invalid HW index")
 
+        self.clearNodes()
+
         # Select API
         api_index = HW_devices[hw_index][1]
         if api_index == 0:
@@ -58,9 +65,52 @@ class HWdevice(QObject):
     @check_api_init
     def clearDevice(self):
         printDbg("HW: Clearing HW device...")
+        self.clearNodes()
         self.api.closeDevice('')
         printOK("HW: device cleared")
 
+    def clearNodes(self):
+        with self.nodesLock:
+            self.nodes.clear()
+
+    def getChainNode(self, account, intExt, isTestnet):
+        # The account node (hardened) is fetched from the device once per session.
+        # Chain and address nodes are derived in software.
+        with self.nodesLock:
+            key = (account, intExt, isTestnet)
+            if key not in self.nodes:
+                acc_key = (account, isTestnet)
+                if acc_key not in self.nodes:
+                    # failures (e.g. PIN prompt cancelled) are not cached: the scans ask for the node
+                    # once, then fall back to the device path by path for the rest of the scan
+                    node = self.api.getAccountNode(account, isTestnet)
+                    if node is None:
+                        return None
+                    self.nodes[acc_key] = node
+                self.nodes[key] = bip32_ckd_pub(self.nodes[acc_key], intExt)
+            return self.nodes[key]
+
+    def getFingerprint(self, account, isTestnet):
+        # identifies the account node (seed and account) in the ADDRESSES table
+        if self.getChainNode(account, 0, isTestnet) is None:
+            return None
+        return bin_hash160(self.nodes[(account, isTestnet)][0])[:4].hex()
+
+    def getAccountXpub(self, account, isTestnet=False):
+        # m/44'/coin'/account' node (depth 3, hardened).
+        # Only from the cache (filled by the scans): None if the device didn't return the node.
+        with self.nodesLock:
+            node = self.nodes.get((account, isTestnet))
+        if node is None:
+            return None
+        return bip32_serialize_pub(node, 3, 0x80000000 + account, isTestnet)
+
+    def derivePubKey(self, account, spath, intExt=0, isTestnet=False):
+        chain_node = self.getChainNode(account, intExt, isTestnet)
+        if chain_node is None:
+            return None
+        return bip32_ckd_pub(chain_node, spath)[0].hex()
+
     # Status codes:
     # 0 - not connected
     # 1 - not initialized
@@ -87,31 +137,59 @@ class HWdevice(QObject):
     @check_api_init
     def scanForAddress(self, hwAcc, spath, intExt=0, isTestnet=False):
         printOK("HW: Scanning for Address n. %d on account n. %d" % (spath, hwAcc))
-        return self.api.scanForAddress(hwAcc, spath, intExt, isTestnet)
+        fingerprint = self.getFingerprint(hwAcc, isTestnet)
+        if fingerprint is None:
+            return self.api.scanForAddress(hwAcc, spath, intExt, isTestnet)
+        # look up the address index first
+        address = self.main_wnd.parent.db.getAddress(fingerprint, isTestnet, hwAcc, intExt, spath)
+        if address is None:
+            address = pubkey_to_address(self.derivePubKey(hwAcc, spath, intExt, isTestnet), isTestnet)
+            # save to the address index
+            self.main_wnd.parent.db.addAddresses(fingerprint, isTestnet, hwAcc, intExt, [(spath, address)])
+        return address
+
+    @check_api_init
+    def scanForAddresses(self, hwAcc, spaths, intExt=0, isTestnet=False):
+        spaths = list(spaths)
+        printOK("HW: Scanning for %d Addresses on account n. %d" % (len(spaths), hwAcc))
+        fingerprint = self.getFingerprint(hwAcc, isTestnet)
+        if fingerprint is None:
+            return [self.api.scanForAddress(hwAcc, i, intExt, isTestnet) for i in spaths]
+        addresses = [pubkey_to_address(self.derivePubKey(hwAcc, i, intExt, isTestnet), isTestnet) for i in spaths]
+        # save to the address index
+        self.main_wnd.parent.db.addAddresses(fingerprint, isTestnet, hwAcc, intExt, zip(spaths, addresses))
+        return addresses
 
     @check_api_init
     def scanForBip32(self, account, address, starting_spath=0, spath_count=10, isTestnet=False):
         printOK("HW: Scanning for Bip32 path of address: %s" % address)
-        found = False
-        spath = -1
-
-        for i in range(starting_spath, starting_spath + spath_count):
-            printDbg("HW: checking path... %d'/0/%d" % (account, i))
-            curr_addr = self.api.scanForAddress(account, i, isTestnet)
-
+        # look up the address index first
+        fingerprint = self.getFingerprint(account, isTestnet)
+        if fingerprint is not None:
+            addr = self.main_wnd.parent.db.getAddressPath(address, fingerprint, isTestnet)
+            if addr is not None and addr['change'] == 0:
+                printDbg("HW: path found in the address index")
+                return (True, addr['idx'])
+
+        spaths = range(starting_spath, starting_spath + spath_count)
+        if fingerprint is None:
+            # no account node: ask the device path by path (without retrying the account node)
+            addresses = (self.api.scanForAddress(account, i, 0, isTestnet) for i in spaths)
+        else:
+            addresses = self.scanForAddresses(account, spaths, 0, isTestnet)
+        for i, curr_addr in zip(spaths, addresses):
             if curr_addr == address:
-                found = True
-                spath = i
-                break
-
-            sleep(0.01)
+                return (True, i)
 
-        return (found, spath)
+        return (False, -1)
 
     @check_api_init
     def scanForPubKey(self, account, spath, isTestnet=False):
         printOK("HW: Scanning for PubKey of address n. %d on account n. %d" % (spath, account))
-        return self.api.scanForPubKey(account, spath, isTestnet)
+        pubkey = self.derivePubKey(account, spath, 0, isTestnet)
+        if pubkey is None:
+            return self.api.scanForPubKey(account, spath, isTestnet)
+        return pubkey
 
     @check_api_init
     def signMess(self, caller, path, message, isTestnet=False):
@@ -15,6 +15,7 @@ from PyQt5.QtWidgets import QMessageBox, QApplication
 from constants import MPATH_LEDGER as MPATH, MPATH_TESTNET, HW_devices
 from misc import printDbg, printException, printOK, getCallerName, getFunctionName, splitString, DisconnectedException
 from pivx_hashlib import pubkey_to_address, single_sha256
+from pivx_parser import ParsedTxCache
 from threads import ThreadFuns
 from txCache import TxCache
 from utils import extract_pkh_from_locking_script, compose_tx_locking_script
@@ -47,6 +48,10 @@ def process_ledger_exceptions(func):
     return process_ledger_exceptions_int
 
 
+# previous txes decoded for the btchip client (needed by getTrustedInput)
+ledgerTxes = ParsedTxCache(lambda raw_tx: bitcoinTransaction(bytearray.fromhex(raw_tx)))
+
+
 class BTchip(btchip):
     def getJCExtendedFeatures(self):
         # Workaround for the incompatibility with the btchip client library introduced in the Ledger PIVX app v2.0.4:
@@ -121,7 +126,7 @@ class LedgerApi(QObject):
         raw_tx = TxCache(self.main_wnd)[utxo['txid']]
 
         # parse the raw transaction, so that we can extract the UTXO locking script we refer to
-        prev_transaction = bitcoinTransaction(bytearray.fromhex(raw_tx))
+        prev_transaction = ledgerTxes.get(utxo['txid'], raw_tx)
 
         utxo_tx_index = utxo['vout']
         if utxo_tx_index < 0 or utxo_tx_index > len(prev_transaction.outputs):
@@ -225,6 +230,14 @@ class LedgerApi(QObject):
 
         return curr_addr
 
+    @process_ledger_exceptions
+    def getAccountNode(self, account, isTestnet=False):
+        curr_path = (MPATH_TESTNET if isTestnet else MPATH) + "%d'" % account
+        with self.lock:
+            nodeData = self.chip.getWalletPublicKey(curr_path)
+
+        return bytes(compress_public_key(nodeData.get('publicKey'))), bytes(nodeData.get('chainCode'))
+
     @process_ledger_exceptions
     def scanForPubKey(self, account, spath, isTestnet=False):
         hwpath = "%d'/0/%d" % (account, spath)
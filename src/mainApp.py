@@ -16,7 +16,7 @@ from time import time
 from database import Database
 from misc import printDbg, initLogs, saveCacheSettings, readCacheSettings, getVersion
 from mainWindow import MainWindow
-from constants import user_dir, SECONDS_IN_2_MONTHS
+from constants import user_dir, SECONDS_IN_2_MONTHS, API_CACHE_TTL
 from qt.dlg_configureRPCservers import ConfigureRPCservers_dlg
 from qt.dlg_signmessage import SignMessage_dlg
 
@@ -75,6 +75,12 @@ class App(QMainWindow):
         if not start_args.clearTxCache:
             self.db.clearRawTxes(time() - SECONDS_IN_2_MONTHS)
 
+        # Remove expired explorer responses
+        self.db.clearApiCache(time() - API_CACHE_TTL)
+
+        # Reclaim the space freed by the deletes (if it's worth it)
+        self.db.compact()
+
         # Read cached app data
         self.cache = readCacheSettings()
 
@@ -111,6 +117,9 @@ class App(QMainWindow):
         # Terminate the running threads.
         # Set the shutdown flag on each thread to trigger a clean shutdown of each thread.
         self.mainWindow.myRpcWd.shutdown_flag.set()
+        self.mainWindow.myRpcProber.shutdown_flag.set()
+        self.mainWindow.myBlockWatcher.shutdown_flag.set()
+        self.mainWindow.apiClient.close()
         logging.debug("Saving stuff & closing...")
         try:
             self.mainWindow.hwdevice.clearDevice()
@@ -129,6 +138,7 @@ class App(QMainWindow):
 
         # clear / close DB
         self.db.removeTable('UTXOS')
+        self.db.compact()
         self.db.close()
 
         # Adios
@@ -138,8 +148,13 @@ class App(QMainWindow):
     def onEditRPCServer(self):
         # Create Dialog
         ui = ConfigureRPCservers_dlg(self)
+        # probe the servers (latency column) while the dialog is open
+        self.mainWindow.rpcServersDlgOpen = True
+        self.mainWindow.updateRPCprobing()
         if ui.exec():
             printDbg("Configuring RPC Servers...")
+        self.mainWindow.rpcServersDlgOpen = False
+        self.mainWindow.updateRPCprobing()
 
     def onSignVerifyMessage(self):
         # Create Dialog
@@ -25,7 +25,7 @@ from tabRewards import TabRewards
 from qt.guiHeader import GuiHeader
 from rpcClient import RpcClient
 from threads import ThreadFuns
-from watchdogThreads import RpcWatchdog
+from watchdogThreads import RpcWatchdog, RpcProber, BlockWatcher
 
 
 class MainWindow(QWidget):
@@ -41,6 +41,18 @@ class MainWindow(QWidget):
     # signal: UTXO list loading percent (emitted by load_utxos_thread in tabRewards)
     sig_UTXOsLoading = pyqtSignal(int)
 
+    # signal: new block (height) on the selected RPC server (emitted by BlockWatcher)
+    sig_newBlock = pyqtSignal(int)
+
+    # signal: latency/sync stats of the RPC servers updated (emitted by RpcProber)
+    sig_RPCprobed = pyqtSignal()
+
+    # signal: derived addresses [path, address, balance] are available (emitted by loadSelection_thread in tabRewards)
+    sig_addressesLoaded = pyqtSignal(object)
+
+    # signal: balance of an address is available (emitted by loadBalance in tabRewards)
+    sig_addressBalance = pyqtSignal(int, str, object)
+
 
     def __init__(self, parent, imgDir):
         super(QWidget, self).__init__(parent)
@@ -55,7 +67,10 @@ class MainWindow(QWidget):
         self.hwStatusMess = "Not Connected"
         self.rpcClient = None
         self.rpcConnected = False
+        self.rpcLastBlock = 0
         self.updatingRPCbox = False
+        # selected server (cached on the GUI thread, for the watcher threads)
+        self.selectedRPCserver = None
         self.rpcStatusMess = "Not Connected"
         self.isBlockchainSynced = False
         # Changes when an RPC client is connected (affecting API client)
@@ -79,7 +94,7 @@ class MainWindow(QWidget):
         self.hwdevice = HWdevice(self)
 
         # -- init Api Client
-        self.apiClient = ApiClient(self.isTestnetRPC)
+        self.apiClient = ApiClient(self.isTestnetRPC, self.parent.db)
 
         # -- Create Queue to redirect stdout
         self.queue = wqueue
@@ -120,9 +135,21 @@ class MainWindow(QWidget):
         # -- Connect buttons/signals
         self.connButtons()
 
-        # -- Create RPC Whatchdog
+        # -- Create and start RPC Prober (daemon thread: it's never waited for on exit)
+        self.myRpcProber = RpcProber(self)
+        self.rpc_proberThread = threading.Thread(target=self.myRpcProber.run, daemon=True)
+        self.rpc_proberThread.start()
+        self.rpcServersDlgOpen = False
+        self.updateRPCprobing()
+
+        # -- Create and start Block Watcher (daemon thread)
+        self.myBlockWatcher = BlockWatcher(self)
+        self.blockWatcherThread = threading.Thread(target=self.myBlockWatcher.run, daemon=True)
+        self.blockWatcherThread.start()
+
+        # -- Create RPC Whatchdog (slowed down while the Block Watcher is active)
         self.rpc_watchdogThread = QThread()
-        self.myRpcWd = RpcWatchdog(self)
+        self.myRpcWd = RpcWatchdog(self, blockWatcher=self.myBlockWatcher)
         self.myRpcWd.moveToThread(self.rpc_watchdogThread)
         self.rpc_watchdogThread.started.connect(self.myRpcWd.run)
 
@@ -161,6 +188,8 @@ class MainWindow(QWidget):
         # -- Connect signals
         self.sig_clearRPCstatus.connect(self.clearRPCstatus)
         self.sig_RPCstatusUpdated.connect(self.showRPCstatus)
+        self.sig_RPCprobed.connect(self.onRPCprobed)
+        self.sig_newBlock.connect(self.onNewBlock)
         self.parent.sig_changed_rpcServers.connect(self.updateRPClist)
 
     def getRPCserver(self):
@@ -275,12 +304,33 @@ class MainWindow(QWidget):
         self.parent.cache['selectedHW_index'] = persistCacheSetting('cache_HWindex', i)
 
     def onChangeSelectedRPC(self, i):
+        self.selectedRPCserver = self.header.rpcClientsBox.itemData(i)
         # Don't update when we are clearing the box
         if not self.updatingRPCbox:
             # persist setting
             self.parent.cache['selectedRPC_index'] = persistCacheSetting('cache_RPCindex', i)
             self.runInThread(self.updateRPCstatus, (True,), )
 
+    def onNewBlock(self, height):
+        # explorer data is stale: clear it before the views are refreshed
+        self.apiClient.invalidateCache()
+        self.runInThread(self.updateRPCstatus, (False,), )
+        self.t_rewards.onNewBlock(height)
+
+    def updateRPCprobing(self):
+        # latencies are needed only for the auto-selection and by the RPC servers dialog
+        self.myRpcProber.setActive(self.parent.cache.get('autoSelectRPC') or self.rpcServersDlgOpen)
+
+    def onRPCprobed(self):
+        # switch to the fastest synced server (if enabled)
+        if not self.parent.cache.get('autoSelectRPC') or self.updatingRPCbox:
+            return
+        current = self.header.rpcClientsBox.itemData(self.header.rpcClientsBox.currentIndex())
+        best = self.myRpcProber.getFastestServer(self.isTestnetRPC, current)
+        if best is not None and best != current:
+            printDbg("Switching to the fastest RPC server: %s" % best['host'])
+            self.header.rpcClientsBox.setCurrentIndex(self.getServerListIndex(best))
+
     def onCleanConsole(self):
         self.consoleArea.clear()
 
@@ -324,6 +374,17 @@ class MainWindow(QWidget):
             if fDebug:
                 myPopUp_sb(self, "info", 'PET4L - rpc check', "%s" % self.rpcStatusMess)
 
+    def getFeePerKb(self):
+        # fee estimate of the last tip seen (never blocks on the RPC server)
+        return self.parent.cache['feePerKb']
+
+    def updateFeePerKb(self, height):
+        feePerKb = self.rpcClient.getFeePerKb()
+        if feePerKb is not None:
+            printDbg("Fee estimate at block %d: %s PIV/kB" % (height, str(feePerKb)))
+            self.parent.cache['feePerKb'] = persistCacheSetting('cache_feePerKb', feePerKb)
+            self.parent.cache['feeHeight'] = persistCacheSetting('cache_feeHeight', height)
+
     def updateHWleds(self):
         if self.hwStatus == 1:
             self.header.hwLed.setPixmap(self.ledHalfPurpleH_icon)
@@ -421,6 +482,7 @@ class MainWindow(QWidget):
             self.parent.cache['selectedRPC_index'] = persistCacheSetting('cache_RPCindex', DefaultCache["selectedRPC_index"])
 
         self.header.rpcClientsBox.setCurrentIndex(self.parent.cache['selectedRPC_index'])
+        self.selectedRPCserver = self.header.rpcClientsBox.itemData(self.header.rpcClientsBox.currentIndex())
         self.updatingRPCbox = False
         # reload servers in configure dialog
         self.sig_RPClistReloaded.emit()
@@ -431,9 +493,11 @@ class MainWindow(QWidget):
             printDbg("Trying to connect to RPC %s://%s..." % (rpc_protocol, rpc_host))
 
         try:
-            rpcClient = RpcClient(rpc_protocol, rpc_host, rpc_user, rpc_password)
-            status, statusMess, lastBlock, r_time1, isTestnet = rpcClient.getStatus()
-            isBlockchainSynced, r_time2 = rpcClient.isBlockchainSynced()
+            # re-use the client (and its keep-alive connection) if the server is unchanged
+            rpcClient = self.rpcClient
+            if rpcClient is None or rpcClient.rpc_url != RpcClient.getUrl(rpc_protocol, rpc_host, rpc_user, rpc_password):
+                rpcClient = RpcClient(rpc_protocol, rpc_host, rpc_user, rpc_password)
+            status, statusMess, lastBlock, r_time, isTestnet, isBlockchainSynced = rpcClient.getStatus()
         except Exception as e:
             printException(getCallerName(), getFunctionName(), "exception updating RPC status:", str(e))
             # clear status
@@ -442,16 +506,22 @@ class MainWindow(QWidget):
             return
 
         rpcResponseTime = None
-        if r_time1 is not None and r_time2 != 0:
-            rpcResponseTime = round((r_time1 + r_time2) / 2, 3)
+        if r_time is not None:
+            rpcResponseTime = round(r_time, 3)
 
         # Do not update status if the user has selected a different server since the start of updateRPCStatus()
         if rpc_index != self.header.rpcClientsBox.currentIndex():
             return
 
         with self.lock:
+            # release the persistent connection of the replaced client
+            if self.rpcClient is not None and self.rpcClient is not rpcClient:
+                self.rpcClient.close()
             self.rpcClient = rpcClient
             self.rpcConnected = status
+            # new block: balances and utxos returned by the explorer are stale
+            if status and lastBlock != self.rpcLastBlock:
+                self.apiClient.invalidateCache()
             self.rpcLastBlock = lastBlock
             self.rpcStatusMess = statusMess
             self.isBlockchainSynced = isBlockchainSynced
@@ -460,5 +530,10 @@ class MainWindow(QWidget):
             if isTestnet != self.isTestnetRPC:
                 self.isTestnetRPC = isTestnet
                 self.parent.cache['isTestnetRPC'] = persistCacheSetting('isTestnetRPC', isTestnet)
-                self.apiClient = ApiClient(isTestnet)
+                self.apiClient.close()
+                self.apiClient = ApiClient(isTestnet, self.parent.db)
         self.sig_RPCstatusUpdated.emit(rpc_index, fDebug)
+
+        # fee estimate (getfeeinfo scans the last 200 blocks): refresh only on a new tip
+        if status and lastBlock != self.parent.cache['feeHeight']:
+            self.updateFeePerKb(lastBlock)
@@ -288,6 +288,10 @@ def readCacheSettings():
         cache["spathFrom"] = settings.value('cache_spathFrom', DefaultCache["spathFrom"], type=int)
         cache["spathTo"] = settings.value('cache_spathTo', DefaultCache["spathTo"], type=int)
         cache["intExt"] = settings.value('cache_intExt', DefaultCache["intExt"], type=int)
+        cache["autoSelectRPC"] = settings.value('cache_autoSelectRPC', DefaultCache["autoSelectRPC"], type=bool)
+        cache["feePerKb"] = settings.value('cache_feePerKb', DefaultCache["feePerKb"], type=float)
+        cache["feeHeight"] = settings.value('cache_feeHeight', DefaultCache["feeHeight"], type=int)
+        cache["scanAccount"] = settings.value('cache_scanAccount', DefaultCache["scanAccount"], type=bool)
         add_defaultKeys_to_dict(cache, DefaultCache)
         return cache
     except:
@@ -314,6 +318,10 @@ def saveCacheSettings(cache):
     settings.setValue('cache_spathFrom', cache.get('spathFrom'))
     settings.setValue('cache_spathTo', cache.get('spathTo'))
     settings.setValue('cache_intExt', cache.get('intExt'))
+    settings.setValue('cache_autoSelectRPC', cache.get('autoSelectRPC'))
+    settings.setValue('cache_feePerKb', cache.get('feePerKb'))
+    settings.setValue('cache_feeHeight', cache.get('feeHeight'))
+    settings.setValue('cache_scanAccount', cache.get('scanAccount'))
 
 
 def sec_to_time(seconds):
@@ -328,9 +336,9 @@ def sec_to_time(seconds):
 
 def timeThis(function, *args):
     try:
-        start = time.clock()
+        start = time.perf_counter()
         val = function(*args)
-        end = time.clock()
+        end = time.perf_counter()
         return val, (end - start)
     except Exception:
         return None, None
@@ -4,8 +4,17 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from functools import lru_cache
+from hashlib import sha256
+
+from constants import B58CHECK_CACHE_SIZE
+
 __b58chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 __b58base = len(__b58chars)
+__b58values = {c: i for i, c in enumerate(__b58chars)}
+# all the pairs of base58 digits: encoding divides by 58**2 and emits two digits per step
+__b58pairs = [a + b for a in __b58chars for b in __b58chars]
+__b58pairsbase = __b58base ** 2
 b58chars = __b58chars
 
 long = int
@@ -17,25 +26,18 @@ def b58encode(v):
     """
     encode v, which is a string of bytes, to base58.
     """
-    long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += (256 ** i) * _bord(c)
-
-    result = ''
-    while long_value >= __b58base:
-        div, mod = divmod(long_value, __b58base)
-        result = __b58chars[mod] + result
-        long_value = div
-    result = __b58chars[long_value] + result
+    long_value = int.from_bytes(v, byteorder='big')
+
+    # digits are collected (two at a time) in reverse order, then joined once
+    result = []
+    while long_value:
+        long_value, mod = divmod(long_value, __b58pairsbase)
+        result.append(__b58pairs[mod])
+    # the last pair might start with a zero digit
+    result = ''.join(reversed(result)).lstrip(__b58chars[0]) or __b58chars[0]
     # Bitcoin does a little leading-zero-compression:
     # leading 0-bytes in the input become leading-1s
-    nPad = 0
-    for c in v:
-        #        if c == '\0': nPad += 1
-        if c == 0:
-            nPad += 1
-        else:
-            break
+    nPad = len(v) - len(bytes(v).lstrip(b'\0'))
 
     return (__b58chars[0] * nPad) + result
 
@@ -44,25 +46,29 @@ def b58decode(v, length=None):
     """ decode v into a string of len bytes
     """
     long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += __b58chars.find(c) * (__b58base ** i)
+    for c in v:
+        long_value = long_value * __b58base + __b58values.get(c, -1)
 
-    result = bytes()
-    while long_value >= 256:
-        div, mod = divmod(long_value, 256)
-        result = _bchr(mod) + result
-        long_value = div
-    result = _bchr(long_value) + result
+    result = long_value.to_bytes(max(1, (long_value.bit_length() + 7) // 8), byteorder='big')
 
-    nPad = 0
-    for c in v:
-        if c == __b58chars[0]:
-            nPad += 1
-        else:
-            break
+    nPad = len(v) - len(v.lstrip(__b58chars[0]))
 
     result = _bchr(0) * nPad + result
     if length is not None and len(result) != length:
         return None
 
     return result
+
+
+@lru_cache(maxsize=B58CHECK_CACHE_SIZE)
+def b58check_verify(v):
+    """ decode v and check that the last 4 bytes are the checksum of the others.
+        Results are cached, as the same addresses get checked over and over
+    """
+    try:
+        data = b58decode(v)
+    except Exception:
+        return False
+    if len(data) < 5:
+        return False
+    return sha256(sha256(data[:-4]).digest()).digest()[:4] == data[-4:]
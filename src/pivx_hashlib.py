@@ -8,7 +8,7 @@ import bitcoin
 import hashlib
 
 from constants import WIF_PREFIX, MAGIC_BYTE, TESTNET_WIF_PREFIX, TESTNET_MAGIC_BYTE, \
-    STAKE_MAGIC_BYTE, TESTNET_STAKE_MAGIC_BYTE
+    STAKE_MAGIC_BYTE, TESTNET_STAKE_MAGIC_BYTE, XPUB_PREFIX, TESTNET_XPUB_PREFIX
 from pivx_b58 import b58encode, b58decode
 
 
@@ -77,3 +77,24 @@ def wif_to_privkey(string):
 
     else:
         return None
+
+
+def bip32_ckd_pub(node, i):
+    """
+    Public (non-hardened) derivation of child i from node = (compressed pubkey, chaincode)
+    """
+    raw_node = (bitcoin.MAINNET_PUBLIC, 0, bytes(4), 0, node[1], node[0])
+    _, _, _, _, chaincode, pubkey = bitcoin.raw_bip32_ckd(raw_node, i)
+    return pubkey, chaincode
+
+
+def bip32_serialize_pub(node, depth, child_number, isTestnet=False):
+    """
+    Extended public key of node = (compressed pubkey, chaincode).
+    The parent fingerprint is not known (zero): the explorers only need pubkey and chaincode.
+    """
+    version = TESTNET_XPUB_PREFIX if isTestnet else XPUB_PREFIX
+    data = version.to_bytes(4, 'big') + bytes([depth]) + bytes(4) + child_number.to_bytes(4, 'big') + \
+        node[1] + node[0]
+    checksum = bitcoin.bin_dbl_sha256(data)[0:4]
+    return b58encode(data + checksum)
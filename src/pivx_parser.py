@@ -4,26 +4,64 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from collections import OrderedDict
+import struct
+import threading
+
+from constants import PARSED_TXES_CACHE_SIZE
 from misc import getCallerName, getFunctionName, printException
 import utils
 from pivx_hashlib import pubkeyhash_to_address
 
 
-class HexParser:
-    def __init__(self, hex_str):
+class BytesParser:
+    '''
+    Reads a serialized tx without copying it: fields are read with struct/int.from_bytes
+    from a memoryview, and converted to hex strings only by readString
+    '''
+    UINT32 = struct.Struct("<I")
+    UINT64 = struct.Struct("<Q")
+
+    def __init__(self, data):
+        # data can be either the raw bytes or the hex string of the tx
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        self.buffer = memoryview(data)
         self.cursor = 0
-        self.hex_str = hex_str
+
+    def checkRange(self, nbytes):
+        if self.cursor + nbytes > len(self.buffer):
+            raise Exception("BytesParser range error")
+
+    def skip(self, nbytes):
+        self.checkRange(nbytes)
+        self.cursor += nbytes
+
+    def readBytes(self, nbytes):
+        self.checkRange(nbytes)
+        res = self.buffer[self.cursor:self.cursor + nbytes]
+        self.cursor += nbytes
+        return res
 
     def readInt(self, nbytes, byteorder="big", signed=False):
-        if self.cursor + nbytes * 2 > len(self.hex_str):
-            raise Exception("HexParser range error")
-        b = bytes.fromhex(self.hex_str[self.cursor:self.cursor + nbytes * 2])
-        res = int.from_bytes(b, byteorder=byteorder, signed=signed)
-        self.cursor += nbytes * 2
+        return int.from_bytes(self.readBytes(nbytes), byteorder=byteorder, signed=signed)
+
+    def readStruct(self, fmt):
+        self.checkRange(fmt.size)
+        res = fmt.unpack_from(self.buffer, self.cursor)[0]
+        self.cursor += fmt.size
         return res
 
+    def readUInt32(self):
+        return self.readStruct(self.UINT32)
+
+    def readUInt64(self):
+        return self.readStruct(self.UINT64)
+
     def readVarInt(self):
-        r = self.readInt(1)
+        self.checkRange(1)
+        r = self.buffer[self.cursor]
+        self.cursor += 1
         if r == 253:
             return self.readInt(2, "little")
         elif r == 254:
@@ -33,14 +71,10 @@ class HexParser:
         return r
 
     def readString(self, nbytes, byteorder="big"):
-        if self.cursor + nbytes * 2 > len(self.hex_str):
-            raise Exception("HexParser range error")
-        res = self.hex_str[self.cursor:self.cursor + nbytes * 2]
-        self.cursor += nbytes * 2
+        res = self.readBytes(nbytes)
         if byteorder == "little":
-            splits = [res[i:i + 2] for i in range(0, len(res), 2)]
-            return ''.join(splits[::-1])
-        return res
+            return res[::-1].hex()
+        return res.hex()
 
 
 def IsCoinBase(vin):
@@ -50,11 +84,11 @@ def IsCoinBase(vin):
 def ParseTxInput(p):
     vin = {}
     vin["txid"] = p.readString(32, "little")
-    vin["vout"] = p.readInt(4, "little")
+    vin["vout"] = p.readUInt32()
     script_len = p.readVarInt()
     vin["scriptSig"] = {}
     vin["scriptSig"]["hex"] = p.readString(script_len, "big")
-    vin["sequence"] = p.readInt(4, "little")
+    vin["sequence"] = p.readUInt32()
     if IsCoinBase(vin):
         del vin["txid"]
         del vin["vout"]
@@ -64,30 +98,45 @@ def ParseTxInput(p):
     return vin
 
 
-def ParseTxOutput(p, isTestnet=False):
+def ParseTxOutput(p, isTestnet=False, withAddresses=True):
     vout = {}
-    vout["value"] = p.readInt(8, "little")
+    vout["value"] = p.readUInt64()
     script_len = p.readVarInt()
     vout["scriptPubKey"] = {}
     vout["scriptPubKey"]["hex"] = p.readString(script_len, "big")
-    vout["scriptPubKey"]["addresses"] = []
+    if withAddresses:
+        GetOutputAddresses(vout, isTestnet)
+    return vout
+
+
+def GetOutputAddresses(vout, isTestnet=False):
+    '''
+    returns the addresses of a decoded output, deriving them (and saving them in vout)
+    only if ParseTx was called without addresses
+    '''
+    if "addresses" in vout["scriptPubKey"]:
+        return vout["scriptPubKey"]["addresses"]
+    addresses = []
     try:
         locking_script = bytes.fromhex(vout["scriptPubKey"]["hex"])
         # add addresses only if P2PKH, P2PK or P2CS
         if len(locking_script) in [25, 35, 51]:
             add_bytes = utils.extract_pkh_from_locking_script(locking_script)
             address = pubkeyhash_to_address(add_bytes, isTestnet)
-            vout["scriptPubKey"]["addresses"].append(address)
+            addresses.append(address)
     except Exception as e:
         printException(getCallerName(True), getFunctionName(True), "error parsing output", str(e))
-    return vout
+    vout["scriptPubKey"]["addresses"] = addresses
+    return addresses
 
 
-def ParseTx(hex_string, isTestnet=False):
-    p = HexParser(hex_string)
+def ParseTx(hex_string, isTestnet=False, withAddresses=True):
+    # withAddresses=False skips the (base58) encoding of the output addresses.
+    # They can be derived later, when needed, with GetOutputAddresses
+    p = BytesParser(hex_string)
     tx = {}
 
-    tx["version"] = p.readInt(4, "little")
+    tx["version"] = p.readUInt32()
 
     num_of_inputs = p.readVarInt()
     tx["vin"] = []
@@ -97,26 +146,120 @@ def ParseTx(hex_string, isTestnet=False):
     num_of_outputs = p.readVarInt()
     tx["vout"] = []
     for i in range(num_of_outputs):
-        tx["vout"].append(ParseTxOutput(p, isTestnet))
+        tx["vout"].append(ParseTxOutput(p, isTestnet, withAddresses))
 
-    tx["locktime"] = p.readInt(4, "little")
+    tx["locktime"] = p.readUInt32()
     return tx
 
 
-def IsPayToColdStaking(rawtx, out_n):
-    tx = ParseTx(rawtx)
-    script = tx['vout'][out_n]["scriptPubKey"]["hex"]
-    return utils.IsPayToColdStaking(bytes.fromhex(script)), IsCoinStake(tx)
+class TxView:
+    '''
+    Lazy view over a serialized tx: the inputs are skipped (reading only their lengths),
+    and the outputs are located one by one, only up to the highest index requested.
+    The full decoding (ParseTx) is done only if toJson is called (and the addresses only if requested)
+    '''
+    def __init__(self, rawtx):
+        self.p = BytesParser(rawtx)
+        self.lock = threading.Lock()
+        self.json = {}
+        self.version = self.p.readUInt32()
+        num_of_inputs = self.p.readVarInt()
+        for i in range(num_of_inputs):
+            # prevout (txid + n)
+            self.p.skip(36)
+            # scriptSig
+            self.p.skip(self.p.readVarInt())
+            # sequence
+            self.p.skip(4)
+        self.num_of_outputs = self.p.readVarInt()
+        # (value, scriptPubKey) of the outputs located so far
+        self.outputs = []
+
+    def getOutput(self, n):
+        if n < 0 or n >= self.num_of_outputs:
+            raise IndexError("TxView: output index %d out of range" % n)
+        with self.lock:
+            while len(self.outputs) <= n:
+                value = self.p.readUInt64()
+                script = self.p.readBytes(self.p.readVarInt())
+                self.outputs.append((value, script))
+        return self.outputs[n]
+
+    def getOutputScript(self, n):
+        return self.getOutput(n)[1]
+
+    def getOutputValue(self, n):
+        return self.getOutput(n)[0]
+
+    def isCoinStake(self):
+        return len(self.getOutputScript(0)) == 0
+
+    def toJson(self, isTestnet=False, withAddresses=False):
+        with self.lock:
+            if isTestnet not in self.json:
+                self.json[isTestnet] = ParseTx(self.p.buffer, isTestnet, withAddresses=False)
+            if withAddresses:
+                for vout in self.json[isTestnet]["vout"]:
+                    GetOutputAddresses(vout, isTestnet)
+        return self.json[isTestnet]
+
+
+class ParsedTxCache:
+    '''
+    LRU cache of decoded transactions, keyed by txid.
+    parse_fun is the decoder applied to the rawtx (hex string) on cache miss.
+    Cached objects are shared: consumers must not modify them
+    '''
+    def __init__(self, parse_fun, maxsize=PARSED_TXES_CACHE_SIZE):
+        self.parse_fun = parse_fun
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.txes = OrderedDict()
+
+    def get(self, txid, rawtx):
+        with self.lock:
+            if txid in self.txes:
+                self.txes.move_to_end(txid)
+                return self.txes[txid]
+
+        tx = self.parse_fun(rawtx)
+
+        with self.lock:
+            self.txes[txid] = tx
+            if len(self.txes) > self.maxsize:
+                self.txes.popitem(last=False)
+
+        return tx
+
+
+# lazy tx views shared by the UTXO loader and the HW clients
+parsedTxes = ParsedTxCache(TxView)
+
+
+def GetTxView(rawtx, txid=None):
+    # without txid, there's no cache key: simply wrap rawtx
+    if txid is None:
+        return TxView(rawtx)
+    return parsedTxes.get(txid, rawtx)
+
+
+def GetParsedTx(rawtx, txid=None):
+    return GetTxView(rawtx, txid).toJson()
+
+
+def IsPayToColdStaking(rawtx, out_n, txid=None):
+    tx = GetTxView(rawtx, txid)
+    script = tx.getOutputScript(out_n)
+    return utils.IsPayToColdStaking(script), tx.isCoinStake()
 
 
 def IsCoinStake(json_tx):
     return json_tx['vout'][0]["scriptPubKey"]["hex"] == ""
 
 
-def GetDelegatedStaker(rawtx, out_n, isTestnet):
-    tx = ParseTx(rawtx)
-    script = tx['vout'][out_n]["scriptPubKey"]["hex"]
-    if not utils.IsPayToColdStaking(bytes.fromhex(script)):
+def GetDelegatedStaker(rawtx, out_n, isTestnet, txid=None):
+    script = GetTxView(rawtx, txid).getOutputScript(out_n)
+    if not utils.IsPayToColdStaking(script):
         return ""
-    pkh = utils.GetDelegatedStaker(bytes.fromhex(script))
+    pkh = bytes(utils.GetDelegatedStaker(script))
     return pubkeyhash_to_address(pkh, isTestnet, isCold=True)
@@ -6,9 +6,9 @@
 
 from PyQt5.QtWidgets import QDialog, QHBoxLayout, QVBoxLayout, QLabel, \
     QListWidget, QFrame, QFormLayout, QComboBox, QLineEdit, QListWidgetItem, \
-    QWidget, QPushButton, QMessageBox
+    QWidget, QPushButton, QMessageBox, QCheckBox
 
-from misc import myPopUp, checkRPCstring
+from misc import myPopUp, checkRPCstring, persistCacheSetting
 from threads import ThreadFuns
 
 
@@ -21,6 +21,7 @@ class ConfigureRPCservers_dlg(QDialog):
         self.initUI()
         self.loadServers()
         self.main_wnd.mainWindow.sig_RPClistReloaded.connect(self.loadServers)
+        self.main_wnd.mainWindow.sig_RPCprobed.connect(self.updateLatencies)
 
     def clearEditFrame(self):
         self.ui.user_edt.clear()
@@ -45,6 +46,10 @@ class ConfigureRPCservers_dlg(QDialog):
             server_text = "<em style='color: purple'>%s</em>" % server_text
         server_row.addWidget(QLabel(server_text))
         server_row.addStretch(1)
+        #  -- Latency (from RpcProber)
+        self.latencyLabels[id, server['isCustom']] = QLabel()
+        self.updateLatency(server)
+        server_row.addWidget(self.latencyLabels[id, server['isCustom']])
         #  -- Edit button
         editBtn = QPushButton()
         editBtn.setIcon(self.main_wnd.mainWindow.editMN_icon)
@@ -78,6 +83,7 @@ class ConfigureRPCservers_dlg(QDialog):
         self.ui.serversBox.clear()
         # Fill serversBox
         self.serverItems = {}
+        self.latencyLabels = {}
         for server in self.main_wnd.mainWindow.rpcServersList:
             self.insert_server_list(server)
 
@@ -91,6 +97,35 @@ class ConfigureRPCservers_dlg(QDialog):
             self.ui.protocol_select.setCurrentIndex(0)
         self.ui.host_edt.setText(server['host'])
 
+    def updateLatency(self, server):
+        stats = self.main_wnd.mainWindow.myRpcProber.getStats(server)
+        label = self.latencyLabels[server['id'], server['isCustom']]
+        if stats is None:
+            label.setText("<em>probing...</em>")
+        elif not stats['online'] or stats['latency'] is None:
+            label.setText("<b style='color:red'>offline</b>")
+        else:
+            text = "%d ms" % round(stats['latency'] * 1000)
+            if not stats['synced']:
+                text += " <b style='color:orange'>(not synced)</b>"
+            elif stats['isTestnet']:
+                text += " (testnet)"
+            label.setText(text)
+        label.setToolTip("block %s - uptime %d%%" % (str(stats['blocks']), round(stats['uptime'] * 100))
+                         if stats is not None else "")
+
+    # Activated by signal sig_RPCprobed from mainWindow
+    def updateLatencies(self):
+        for server in self.main_wnd.mainWindow.rpcServersList:
+            if (server['id'], server['isCustom']) in self.latencyLabels:
+                self.updateLatency(server)
+
+    def onAutoSelect(self, checked):
+        self.main_wnd.cache['autoSelectRPC'] = persistCacheSetting('cache_autoSelectRPC', checked)
+        self.main_wnd.mainWindow.updateRPCprobing()
+        if checked:
+            self.main_wnd.mainWindow.onRPCprobed()
+
     def onAddServer(self, index=None):
         # Save current index (None for new entry)
         self.changing_index = index
@@ -165,6 +200,10 @@ class Ui_ConfigureRPCserversDlg(object):
         #  -- Servers List
         self.serversBox = QListWidget()
         self.layout.addWidget(self.serversBox)
+        #  -- Auto-select checkbox
+        self.autoSelect_chk = QCheckBox("Automatically switch to the fastest synced server")
+        self.autoSelect_chk.setChecked(ConfigureRPCserversDlg.main_wnd.cache.get('autoSelectRPC', False))
+        self.layout.addWidget(self.autoSelect_chk)
         #  -- 'Add Server' button
         self.addServer_btn = QPushButton("Add RPC Server")
         self.layout.addWidget(self.addServer_btn)
@@ -209,3 +248,4 @@ class Ui_ConfigureRPCserversDlg(object):
         self.close_btn.clicked.connect(lambda: ConfigureRPCserversDlg.onClose())
         self.cancel_btn.clicked.connect(lambda: ConfigureRPCserversDlg.onCancel())
         self.save_btn.clicked.connect(lambda: ConfigureRPCserversDlg.onSave())
+        self.autoSelect_chk.toggled.connect(lambda checked: ConfigureRPCserversDlg.onAutoSelect(checked))
@@ -4,17 +4,135 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from operator import itemgetter
 import sys
 import os.path
 
-from PyQt5.QtCore import Qt
-from PyQt5.Qt import QLabel, QFormLayout, QDoubleSpinBox, QTableWidget, QTableWidgetItem, QAbstractItemView, QHeaderView, QSpinBox
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+from PyQt5.Qt import QLabel, QFormLayout, QDoubleSpinBox, QTableView, QAbstractItemView, QHeaderView, QSpinBox, \
+    QCheckBox
 from PyQt5.QtWidgets import QWidget, QPushButton, QHBoxLayout, QGroupBox, QVBoxLayout
 from PyQt5.QtWidgets import QLineEdit, QComboBox, QProgressBar
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 
+class RewardsModel(QAbstractTableModel):
+    '''
+    Table model for the rewards list.
+    Each reward is kept as a compact tuple (satoshis, confirmations, txid, vout, staker, coinstake)
+    and the cells are rendered only when the view asks for them (i.e. for the visible rows).
+    Sorting is done here, on the tuples, without going through data() (see RewardsProxyModel).
+    '''
+    headers = ["PIVs", "Confirmations", "TX Hash", "TX Output N"]
+
+    def __init__(self, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.rewards = []
+        self.requiredConfirmations = 101
+        self.coldStaking_icon = None
+        self.sortColumn = -1
+        self.sortOrder = Qt.AscendingOrder
+
+    def setRewards(self, rewards, requiredConfirmations):
+        self.beginResetModel()
+        self.rewards = [(int(r['satoshis']), r['confirmations'], r['txid'], r['vout'], r['staker'], r['coinstake'])
+                        for r in rewards]
+        if self.sortColumn >= 0:
+            self.rewards.sort(key=itemgetter(self.sortColumn), reverse=(self.sortOrder == Qt.DescendingOrder))
+        self.requiredConfirmations = requiredConfirmations
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sortColumn = column
+        self.sortOrder = order
+        if column < 0:
+            return
+        self.layoutAboutToBeChanged.emit()
+        # sort the row numbers, so that the persistent indexes (e.g. the selection) can follow the rows
+        rows = sorted(range(len(self.rewards)), key=lambda i: self.rewards[i][column],
+                      reverse=(order == Qt.DescendingOrder))
+        self.rewards = [self.rewards[i] for i in rows]
+        newRow = [0] * len(rows)
+        for new, old in enumerate(rows):
+            newRow[old] = new
+        oldIndexes = self.persistentIndexList()
+        self.changePersistentIndexList(oldIndexes, [self.index(newRow[idx.row()], idx.column()) for idx in oldIndexes])
+        self.layoutChanged.emit()
+
+    def clear(self):
+        self.beginResetModel()
+        self.rewards = []
+        self.endResetModel()
+
+    def outpoint(self, row):
+        return self.rewards[row][2], self.rewards[row][3]
+
+    def satoshis(self, row):
+        return self.rewards[row][0]
+
+    def isImmature(self, row):
+        reward = self.rewards[row]
+        return bool(reward[5]) and reward[1] < self.requiredConfirmations
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rewards)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole:
+                return self.headers[section]
+            if role == Qt.TextAlignmentRole:
+                return Qt.AlignCenter
+        return None
+
+    def flags(self, index):
+        if not index.isValid() or self.isImmature(index.row()):
+            # make immature rewards unselectable
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        reward = self.rewards[index.row()]
+        col = index.column()
+        if role == Qt.DisplayRole:
+            if col == 0:
+                return str(round(reward[0] / 1e8, 8))
+            return str(reward[col])
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if role == Qt.DecorationRole:
+            if col == 2 and reward[4] != "":
+                return self.coldStaking_icon
+            return None
+        if role == Qt.ToolTipRole:
+            ttip = ""
+            if col == 2 and reward[4] != "":
+                ttip = "Staked by <b>%s</b>" % reward[4]
+            if self.isImmature(index.row()):
+                ttip += "\n(Immature - %d confirmations required)" % self.requiredConfirmations
+            return ttip if ttip != "" else None
+        return None
+
+
+class RewardsProxyModel(QSortFilterProxyModel):
+    '''
+    Filters the rewards. Sorting is forwarded to the source model: sorting in the proxy
+    would call the python data() method for every comparison.
+    '''
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+
 class TabRewards_gui(QWidget):
     def __init__(self, imgDir, *args, **kwargs):
         QWidget.__init__(self)
@@ -65,6 +183,11 @@ class TabRewards_gui(QWidget):
         self.edt_internalExternal.setMaximum(1)
         line1.addWidget(self.edt_internalExternal)
         line1.addStretch(1)
+        self.chk_scanAccount = QCheckBox("Scan account")
+        self.chk_scanAccount.setToolTip("Get the balances of the whole account with a single explorer query.\n"
+                                        "WARNING: the account xpub is sent to the explorer, which can then\n"
+                                        "link all the (past and future) addresses of the account.")
+        line1.addWidget(self.chk_scanAccount)
         self.btn_reload = QPushButton("Load/Refresh")
         self.btn_reload.setToolTip("Reload data from ledger device")
         line1.addWidget(self.btn_reload)
@@ -84,33 +207,32 @@ class TabRewards_gui(QWidget):
         self.rewardsList.statusLabel = QLabel('<b style="color:red">Reload Rewards</b>')
         self.rewardsList.statusLabel.setVisible(True)
         self.rewardsList.addWidget(self.rewardsList.statusLabel)
-        self.rewardsList.box = QTableWidget()
+        self.rewardsList.filterLine = QLineEdit()
+        self.rewardsList.filterLine.setPlaceholderText("Filter rewards (amount, confirmations, TX hash)")
+        self.rewardsList.filterLine.setClearButtonEnabled(True)
+        self.rewardsList.addWidget(self.rewardsList.filterLine)
+        self.rewardsList.model = RewardsModel()
+        self.rewardsList.proxy = RewardsProxyModel()
+        self.rewardsList.proxy.setSourceModel(self.rewardsList.model)
+        self.rewardsList.proxy.setFilterKeyColumn(-1)
+        self.rewardsList.proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.rewardsList.filterLine.textChanged.connect(self.rewardsList.proxy.setFilterFixedString)
+        self.rewardsList.box = QTableView()
+        self.rewardsList.box.setModel(self.rewardsList.proxy)
         self.rewardsList.box.setMinimumHeight(230)
         # self.rewardsList.box.setMaximumHeight(140)
         self.rewardsList.box.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.rewardsList.box.setSelectionMode(QAbstractItemView.MultiSelection)
         self.rewardsList.box.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.rewardsList.box.setShowGrid(True)
-        self.rewardsList.box.setColumnCount(4)
-        self.rewardsList.box.setRowCount(0)
+        self.rewardsList.box.setSortingEnabled(True)
+        self.rewardsList.box.sortByColumn(1, Qt.AscendingOrder)
+        # column widths follow the contents, but only the first 100 rows (plus the visible ones) are measured
+        self.rewardsList.box.horizontalHeader().setResizeContentsPrecision(100)
+        self.rewardsList.box.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
         self.rewardsList.box.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.rewardsList.box.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.rewardsList.box.verticalHeader().hide()
-        item = QTableWidgetItem()
-        item.setText("PIVs")
-        item.setTextAlignment(Qt.AlignCenter)
-        self.rewardsList.box.setHorizontalHeaderItem(0, item)
-        item = QTableWidgetItem()
-        item.setText("Confirmations")
-        item.setTextAlignment(Qt.AlignCenter)
-        self.rewardsList.box.setHorizontalHeaderItem(1, item)
-        item = QTableWidgetItem()
-        item.setText("TX Hash")
-        item.setTextAlignment(Qt.AlignCenter)
-        self.rewardsList.box.setHorizontalHeaderItem(2, item)
-        item = QTableWidgetItem()
-        item.setText("TX Output N")
-        item.setTextAlignment(Qt.AlignCenter)
-        self.rewardsList.box.setHorizontalHeaderItem(3, item)
         self.rewardsList.addWidget(self.rewardsList.box)
         layout.addRow(self.rewardsList)
         # --- ROW 3
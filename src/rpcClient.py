@@ -4,50 +4,89 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
-from bitcoinrpc.authproxy import AuthServiceProxy
+from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
 
 import http.client as httplib
 import ssl
 import threading
+from time import time, perf_counter
 
-from constants import DEFAULT_PROTOCOL_VERSION, MINIMUM_FEE
+from constants import DEFAULT_PROTOCOL_VERSION, MINIMUM_FEE, RPC_BATCH_SIZE, RPC_KEEPALIVE_TIMEOUT
 from misc import getCallerName, getFunctionName, printException, printDbg, now, timeThis
 
 
-def process_RPC_exceptions(func):
-    def process_RPC_exceptions_int(*args, **kwargs):
-        try:
-            args[0].httpConnection.connect()
-            return func(*args, **kwargs)
+def process_RPC_exceptions(func=None, retry=True):
+    '''
+    Connection errors are retried once (after reconnecting) only if retry is True.
+    Use retry=False for the calls that are not idempotent (e.g. sendrawtransaction):
+    the request might have reached the server before the connection dropped.
+    '''
+    if func is None:
+        return lambda f: process_RPC_exceptions(f, retry)
 
-        except Exception as e:
-            message = "Exception in RPC client"
-            printException(getCallerName(True), getFunctionName(True), message, str(e))
-        finally:
+    def process_RPC_exceptions_int(*args, **kwargs):
+        client = args[0]
+        with client.lock:
             try:
-                args[0].httpConnection.close()
+                client.checkConnection()
+                try:
+                    return func(*args, **kwargs)
+
+                except (httplib.HTTPException, ConnectionError) as e:
+                    if not retry:
+                        raise
+                    # the server dropped the keep-alive connection: reconnect and retry once
+                    printDbg("RPC: connection lost (%s). Reconnecting..." % str(e))
+                    client.resetConnection()
+                    return func(*args, **kwargs)
+
             except Exception as e:
-                printDbg(e)
-                pass
+                message = "Exception in RPC client"
+                printException(getCallerName(True), getFunctionName(True), message, str(e))
+                client.resetConnection()
+            finally:
+                client.lastUsed = time()
 
     return process_RPC_exceptions_int
 
 
 class RpcClient:
 
-    def __init__(self, rpc_protocol, rpc_host, rpc_user, rpc_password):
+    def __init__(self, rpc_protocol, rpc_host, rpc_user, rpc_password, timeout=20):
         # Lock for threads
         self.lock = threading.RLock()
 
-        self.rpc_url = "%s://%s:%s@%s" % (rpc_protocol, rpc_user, rpc_password, rpc_host)
+        self.rpc_url = self.getUrl(rpc_protocol, rpc_host, rpc_user, rpc_password)
 
         host, port = rpc_host.split(":")
         if rpc_protocol == "https":
-            self.httpConnection = httplib.HTTPSConnection(host, port, timeout=20, context=ssl._create_unverified_context())
+            self.httpConnection = httplib.HTTPSConnection(host, port, timeout=timeout, context=ssl._create_unverified_context())
         else:
-            self.httpConnection = httplib.HTTPConnection(host, port, timeout=20)
+            self.httpConnection = httplib.HTTPConnection(host, port, timeout=timeout)
 
+        # the same (keep-alive) connection is re-used for all the calls
         self.conn = AuthServiceProxy(self.rpc_url, timeout=1000, connection=self.httpConnection)
+        self.lastUsed = time()
+
+    @staticmethod
+    def getUrl(rpc_protocol, rpc_host, rpc_user, rpc_password):
+        return "%s://%s:%s@%s" % (rpc_protocol, rpc_user, rpc_password, rpc_host)
+
+    def checkConnection(self):
+        # an idle connection might have been closed on the server side: re-open it
+        if self.httpConnection.sock is not None and time() - self.lastUsed > RPC_KEEPALIVE_TIMEOUT:
+            self.resetConnection()
+
+    def close(self):
+        with self.lock:
+            self.resetConnection()
+
+    def resetConnection(self):
+        # the connection is opened again, automatically, with the next request
+        try:
+            self.httpConnection.close()
+        except Exception as e:
+            printDbg(e)
 
     @process_RPC_exceptions
     def getBlockCount(self):
@@ -184,24 +223,68 @@ class RpcClient:
 
         return res
 
+    @process_RPC_exceptions
+    def getRawTransactions(self, txids):
+        printDbg("RPC: Getting %d raw transactions..." % len(txids))
+        res = {}
+        with self.lock:
+            for i in range(0, len(txids), RPC_BATCH_SIZE):
+                chunk = txids[i:i + RPC_BATCH_SIZE]
+                try:
+                    rawtxes = self.conn.batch_([["getrawtransaction", txid] for txid in chunk])
+                except (JSONRPCException, TypeError, KeyError) as e:
+                    # a single failing call makes the whole batch fail (and a server rejecting the batch
+                    # altogether replies with a single error object): fallback to one request per tx
+                    printDbg("RPC: batch request failed (%s). Fetching txes one by one..." % str(e))
+                    rawtxes = []
+                    for txid in chunk:
+                        try:
+                            rawtxes.append(self.conn.getrawtransaction(txid))
+                        except JSONRPCException:
+                            rawtxes.append(None)
+                res.update(zip(chunk, rawtxes))
+
+        return res
+
+    def getStatusCalls(self):
+        '''
+        getinfo, getblockcount and mnsync status in a single JSON-RPC batch.
+        Returns isTestnet, block count, IsBlockchainSynced and the round trip time
+        '''
+        with self.lock:
+            try:
+                start = perf_counter()
+                info, n, sync = self.conn.batch_([["getinfo"], ["getblockcount"], ["mnsync", "status"]])
+                response_time = perf_counter() - start
+
+            except (JSONRPCException, TypeError, KeyError) as e:
+                # batch rejected by the server (or a single call failed): fallback to one request per call
+                printDbg("RPC: status batch failed (%s). Sending the calls one by one..." % str(e))
+                info = self.conn.getinfo()
+                start = perf_counter()
+                n = self.conn.getblockcount()
+                response_time = perf_counter() - start
+                try:
+                    sync = self.conn.mnsync('status')
+                except JSONRPCException:
+                    # mnsync refused: not connected is decided by getblockcount only
+                    sync = None
+
+        isBlockchainSynced = sync.get("IsBlockchainSynced", False) if sync is not None else False
+        return info['testnet'], n if n is not None else 0, isBlockchainSynced, response_time
+
     @process_RPC_exceptions
     def getStatus(self):
         status = False
         statusMess = "Unable to connect to a PIVX RPC server.\n"
         statusMess += "Either the local PIVX wallet is not open, or the remote RPC server is not responding."
-        n = 0
-        response_time = None
-        with self.lock:
-            isTestnet = self.conn.getinfo()['testnet']
-            n, response_time = timeThis(self.conn.getblockcount)
-            if n is None:
-                n = 0
+        isTestnet, n, isBlockchainSynced, response_time = self.getStatusCalls()
 
         if n > 0:
             status = True
             statusMess = "Connected to PIVX Blockchain"
 
-        return status, statusMess, n, response_time, isTestnet
+        return status, statusMess, n, response_time, isTestnet, isBlockchainSynced
 
     @process_RPC_exceptions
     def isBlockchainSynced(self):
@@ -214,7 +297,7 @@ class RpcClient:
 
         return res, response_time
 
-    @process_RPC_exceptions
+    @process_RPC_exceptions(retry=False)
     def mnBudgetRawVote(self, mn_tx_hash, mn_tx_index, proposal_hash, vote, time, vote_sig):
         res = None
         with self.lock:
@@ -231,7 +314,7 @@ class RpcClient:
 
         return res
 
-    @process_RPC_exceptions
+    @process_RPC_exceptions(retry=False)
     def relaymasternodebroadcast(self, work):
         printDbg("RPC: Relaying masternode broadcast...")
         res = ""
@@ -240,7 +323,7 @@ class RpcClient:
 
         return res
 
-    @process_RPC_exceptions
+    @process_RPC_exceptions(retry=False)
     def sendRawTransaction(self, tx_hex):
         dbg_mess = "RPC: Sending raw transaction"
         dbg_mess += "..."
@@ -4,14 +4,14 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import simplejson as json
 
 from PyQt5.Qt import QApplication
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QMessageBox, QTableWidgetItem, QHeaderView
+from PyQt5.QtWidgets import QMessageBox
 
-from constants import MINIMUM_FEE
+from constants import MINIMUM_FEE, BALANCE_WORKERS
 from misc import printDbg, printError, printException, getCallerName, getFunctionName, \
     persistCacheSetting, myPopUp, myPopUp_sb, DisconnectedException, checkTxInputs
 from pivx_parser import ParseTx, IsPayToColdStaking, GetDelegatedStaker
@@ -30,6 +30,8 @@ class TabRewards:
 
         # --- Initialize Selection
         self.selectedRewards = None
+        self.selection = {}     # (txid, vout) -> satoshis
+        self.selectionTotal = 0
         self.feePerKb = MINIMUM_FEE
         self.suggestedFee = MINIMUM_FEE
 
@@ -37,6 +39,7 @@ class TabRewards:
         self.ui = TabRewards_gui(self.caller.imgDir)
         self.caller.tabRewards = self.ui
         self.ui.btn_Copy.setIcon(self.caller.copy_icon)
+        self.ui.rewardsList.model.coldStaking_icon = self.caller.coldStaking_icon
 
         # load cache
         self.ui.destinationLine.setText(self.caller.parent.cache.get("lastAddress"))
@@ -44,13 +47,14 @@ class TabRewards:
         self.ui.edt_spathFrom.setValue(self.caller.parent.cache["spathFrom"])
         self.ui.edt_spathTo.setValue(self.caller.parent.cache["spathTo"])
         self.ui.edt_internalExternal.setValue(self.caller.parent.cache["intExt"])
+        self.ui.chk_scanAccount.setChecked(self.caller.parent.cache["scanAccount"])
 
         self.updateFee()
 
         # Connect GUI buttons
         self.ui.addySelect.currentIndexChanged.connect(lambda: self.onChangeSelected())
-        self.ui.rewardsList.box.itemClicked.connect(lambda: self.updateSelection())
         self.ui.btn_reload.clicked.connect(lambda: self.loadSelection())
+        self.ui.chk_scanAccount.clicked.connect(lambda checked: self.onScanAccount(checked))
         self.ui.btn_selectAllRewards.clicked.connect(lambda: self.onSelectAllRewards())
         self.ui.btn_deselectAllRewards.clicked.connect(lambda: self.onDeselectAllRewards())
         self.ui.btn_sendRewards.clicked.connect(lambda: self.onSendRewards())
@@ -59,57 +63,27 @@ class TabRewards:
 
         # Connect Signals
         self.caller.sig_UTXOsLoading.connect(self.update_loading_utxos)
+        self.caller.sig_addressesLoaded.connect(self.addAddresses)
+        self.caller.sig_addressBalance.connect(self.updateAddressBalance)
+        self.ui.rewardsList.box.selectionModel().selectionChanged.connect(self.onSelectionChanged)
+        self.ui.rewardsList.model.modelReset.connect(self.onSelectionReset)
 
     def display_utxos(self):
         # update fee
         if self.caller.rpcConnected:
-            self.feePerKb = self.caller.rpcClient.getFeePerKb()
-            if self.feePerKb is None:
-                self.feePerKb = MINIMUM_FEE
+            self.feePerKb = self.caller.getFeePerKb()
         else:
             self.feePerKb = MINIMUM_FEE
 
         rewards = self.caller.parent.db.getRewardsList(self.curr_addr)
 
         if rewards is not None:
-            def item(value):
-                item = QTableWidgetItem(value)
-                item.setTextAlignment(Qt.AlignCenter)
-                item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-                return item
-
-            # Clear up old list
-            self.ui.rewardsList.box.setRowCount(0)
-            # Make room for new list
-            self.ui.rewardsList.box.setRowCount(len(rewards))
-            # Insert items
-            for row, utxo in enumerate(rewards):
-                txId = utxo.get('txid', None)
-                pivxAmount = round(int(utxo.get('satoshis', 0)) / 1e8, 8)
-                self.ui.rewardsList.box.setItem(row, 0, item(str(pivxAmount)))
-                self.ui.rewardsList.box.setItem(row, 1, item(str(utxo.get('confirmations', None))))
-                self.ui.rewardsList.box.setItem(row, 2, item(txId))
-                self.ui.rewardsList.box.setItem(row, 3, item(str(utxo.get('vout', None))))
-                self.ui.rewardsList.box.showRow(row)
-                if utxo['staker'] != "":
-                    self.ui.rewardsList.box.item(row, 2).setIcon(self.caller.coldStaking_icon)
-                    self.ui.rewardsList.box.item(row, 2).setToolTip("Staked by <b>%s</b>" % utxo['staker'])
-
-                # make immature rewards unselectable
-                if utxo['coinstake']:
-                    required = 16 if self.caller.isTestnetRPC else 101
-                    if utxo['confirmations'] < required:
-                        for i in range(0, 4):
-                            self.ui.rewardsList.box.item(row, i).setFlags(Qt.NoItemFlags)
-                            ttip = self.ui.rewardsList.box.item(row, i).toolTip()
-                            self.ui.rewardsList.box.item(row, i).setToolTip(
-                                ttip + "\n(Immature - %d confirmations required)" % required)
-
-            self.ui.rewardsList.box.resizeColumnsToContents()
+            # Replace the rows of the model (cells are rendered lazily by the view)
+            required = 16 if self.caller.isTestnetRPC else 101
+            self.ui.rewardsList.model.setRewards(rewards, required)
 
             if len(rewards) > 0:
                 self.ui.rewardsList.statusLabel.setVisible(False)
-                self.ui.rewardsList.box.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
 
             else:
                 if not self.caller.rpcConnected:
@@ -118,21 +92,32 @@ class TabRewards:
                     self.ui.resetStatusLabel('<b style="color:red">Found no Rewards for %s</b>' % self.curr_addr)
 
     def getSelection(self):
-        # Get selected rows indexes
-        items = self.ui.rewardsList.box.selectedItems()
-        rows = set()
-        for i in range(0, len(items)):
-            row = items[i].row()
-            rows.add(row)
-        indexes = list(rows)
-        # Get UTXO info from DB for each
-        selection = []
-        for idx in indexes:
-            txid = self.ui.rewardsList.box.item(idx, 2).text()
-            txidn = int(self.ui.rewardsList.box.item(idx, 3).text())
-            selection.append(self.caller.parent.db.getReward(txid, txidn))
-
-        return selection
+        # Get UTXO info from DB for the whole selection at once
+        return self.caller.parent.db.getRewards(self.selection.keys())
+
+    def selectedOutpoints(self, itemSelection):
+        # Map the (proxy) selection ranges to the rows of the model (immature rewards are not selectable)
+        proxy = self.ui.rewardsList.proxy
+        model = self.ui.rewardsList.model
+        rows = set(proxy.mapToSource(idx).row() for idx in itemSelection.indexes())
+        return [(model.outpoint(row), model.satoshis(row)) for row in rows]
+
+    # Activated by signal selectionChanged from rewardsList.box
+    def onSelectionChanged(self, selected, deselected):
+        for outpoint, satoshis in self.selectedOutpoints(deselected):
+            if self.selection.pop(outpoint, None) is not None:
+                self.selectionTotal -= satoshis
+        for outpoint, satoshis in self.selectedOutpoints(selected):
+            if outpoint not in self.selection:
+                self.selection[outpoint] = satoshis
+                self.selectionTotal += satoshis
+        self.updateSelection()
+
+    # Activated by signal modelReset from rewardsList.model (the view drops the selection silently)
+    def onSelectionReset(self):
+        self.selection = {}
+        self.selectionTotal = 0
+        self.updateSelection()
 
     def loadSelection(self):
         # Check dongle
@@ -158,55 +143,99 @@ class TabRewards:
         self.caller.parent.cache["spathTo"] = persistCacheSetting('cache_spathTo', spathTo)
         self.caller.parent.cache["intExt"] = persistCacheSetting('cache_intExt', intExt)
 
-        for i in range(spathFrom, spathTo + 1):
+        # Derive the addresses (and save them to the address index)
+        spaths = range(spathFrom, spathTo + 1)
+        addresses = self.caller.hwdevice.scanForAddresses(hwAcc, spaths, intExt, isTestnet)
+
+        # Get balances (and utxos) of the whole account with a single xpub query, if enabled.
+        # Off by default: the explorer would be able to link all the addresses of the account.
+        account_balances = None
+        if self.caller.parent.cache["scanAccount"]:
+            xpub = self.caller.hwdevice.getAccountXpub(hwAcc, isTestnet)
+            if xpub is not None:
+                account_balances = self.caller.apiClient.scanAccount(xpub)
+        if account_balances is None:
+            account_balances = {}
+
+        # The items are added to addySelect on the GUI thread (with sig_addressesLoaded)
+        items = []
+        for i, address in zip(spaths, addresses):
             path = "%d'/%d/%d" % (hwAcc, intExt, i)
-            address = self.caller.hwdevice.scanForAddress(hwAcc, i, intExt, isTestnet)
-            try:
-                balance = self.caller.apiClient.getBalance(address)
-            except Exception as e:
-                print(e)
-                balance = 0
-
-            itemLine = "%s  --  %s" % (path, address)
-            if (balance):
-                itemLine += "   [%s PIV]" % str(balance)
-
-            self.ui.addySelect.addItem(itemLine, [path, address, balance])
+            balance = account_balances[address]['balance'] if address in account_balances else None
+            items.append([path, address, balance])
+        self.caller.sig_addressesLoaded.emit(items)
+
+        # Fetch the remaining balances concurrently.
+        # The items are updated (with sig_addressBalance) as the balances arrive.
+        with ThreadPoolExecutor(max_workers=BALANCE_WORKERS) as pool:
+            for row, item in enumerate(items):
+                if item[2] is None:
+                    pool.submit(self.loadBalance, row, item[1])
+
+    def addressItemLine(self, path, address, balance=None):
+        itemLine = "%s  --  %s" % (path, address)
+        if (balance):
+            itemLine += "   [%s PIV]" % str(balance)
+        return itemLine
+
+    def loadBalance(self, row, address):
+        try:
+            balance = self.caller.apiClient.getBalance(address)
+        except Exception as e:
+            print(e)
+            balance = 0
+        self.caller.sig_addressBalance.emit(row, address, balance)
 
     def load_utxos_thread(self, ctrl):
         with self.Lock:
-            # clear utxos DB
             printDbg("Updating UTXOs...")
-            self.caller.parent.db.clearTable('UTXOS')
-
             if not self.caller.rpcConnected:
+                # clear utxos DB
+                self.caller.parent.db.clearTable('UTXOS')
                 printError(getCallerName(), getFunctionName(), 'PIVX daemon not connected - Unable to update UTXO list')
                 return
 
             utxos = self.caller.apiClient.getAddressUtxos(self.curr_addr)
-            total_num_of_utxos = len(utxos)
 
+            # Diff against the utxos already saved for this address: only the new ones need to be parsed
+            stored_utxos = {(r['txid'], r['vout']): r for r in self.caller.parent.db.getRewardsList(self.curr_addr)}
+            fetched_utxos = {(u['txid'], u['vout']): u for u in utxos}
+            spent_utxos = [r for k, r in stored_utxos.items() if k not in fetched_utxos]
+            unspent_utxos = [u for k, u in fetched_utxos.items() if k in stored_utxos]
+            new_utxos = [u for k, u in fetched_utxos.items() if k not in stored_utxos]
+            printDbg("UTXOs: %d new, %d spent, %d unchanged" % (len(new_utxos), len(spent_utxos), len(unspent_utxos)))
+            total_num_of_utxos = len(new_utxos)
+
+            # Get all raw txes at once (from DB, or with batch requests to the RPC server)
+            rawtxes = TxCache(self.caller).prefetch([u['txid'] for u in new_utxos])
+
+            rewards = []
             curr_utxo = 0
-            for u in utxos:
+            for u in new_utxos:
+                # emit percent
+                percent = int(100 * curr_utxo / total_num_of_utxos)
+                self.caller.sig_UTXOsLoading.emit(percent)
+                curr_utxo += 1
+
                 u['receiver'] = self.curr_addr
                 # Get raw tx
-                u['rawtx'] = TxCache(self.caller)[u['txid']]
+                u['rawtx'] = rawtxes.get(u['txid'])
                 if u['rawtx'] is None:
                     printDbg("Unable to get raw TX with hash=%s from RPC server." % u['txid'])
                     # Don't save UTXO if raw TX is unavailable
-                    utxos.remove(u)
+                    continue
                 u['staker'] = ""
-                p2cs, u['coinstake'] = IsPayToColdStaking(u['rawtx'], u['vout'])
+                p2cs, u['coinstake'] = IsPayToColdStaking(u['rawtx'], u['vout'], u['txid'])
                 if p2cs:
-                    u['staker'] = GetDelegatedStaker(u['rawtx'], u['vout'], self.caller.isTestnetRPC)
+                    u['staker'] = GetDelegatedStaker(u['rawtx'], u['vout'], self.caller.isTestnetRPC, u['txid'])
 
-                # Save utxo to db
-                self.caller.parent.db.addReward(u)
+                rewards.append(u)
 
-                # emit percent
-                percent = int(100 * curr_utxo / total_num_of_utxos)
-                self.caller.sig_UTXOsLoading.emit(percent)
-                curr_utxo += 1
+            # Update the utxos in the DB with a single transaction
+            with self.caller.parent.db.session():
+                self.caller.parent.db.deleteRewards(spent_utxos)
+                self.caller.parent.db.updateRewardsConfirmations(unspent_utxos)
+                self.caller.parent.db.addRewards(rewards)
 
             printDbg("--# REWARDS table updated")
             self.caller.sig_UTXOsLoading.emit(100)
@@ -241,13 +270,38 @@ class TabRewards:
             if self.curr_balance is not None:
                 self.runInThread = ThreadFuns.runInThread(self.load_utxos_thread, (), self.display_utxos)
 
+    # Activated by signal sig_addressesLoaded from loadSelection_thread
+    def addAddresses(self, items):
+        for path, address, balance in items:
+            self.ui.addySelect.addItem(self.addressItemLine(path, address, balance), [path, address, balance])
+
+    # Activated by signal sig_addressBalance from loadBalance
+    def updateAddressBalance(self, row, address, balance):
+        data = self.ui.addySelect.itemData(row)
+        if data is None or data[1] != address:
+            # the address list has been reloaded in the meantime
+            return
+        path = data[0]
+        self.ui.addySelect.setItemText(row, self.addressItemLine(path, address, balance))
+        self.ui.addySelect.setItemData(row, [path, address, balance])
+        if row == self.ui.addySelect.currentIndex():
+            self.onChangeSelected()
+
+    # Called by mainWindow.onNewBlock
+    def onNewBlock(self, height):
+        # refresh confirmations/maturity of the displayed rewards (unless the user is selecting them)
+        if self.ui.addySelect.currentIndex() >= 0 and not self.ui.rewardsList.box.selectionModel().hasSelection() \
+                and not self.Lock.locked():
+            self.onChangeSelected()
+
+    def onScanAccount(self, checked):
+        self.caller.parent.cache["scanAccount"] = persistCacheSetting('cache_scanAccount', checked)
+
     def onSelectAllRewards(self):
         self.ui.rewardsList.box.selectAll()
-        self.updateSelection()
 
     def onDeselectAllRewards(self):
         self.ui.rewardsList.box.clearSelection()
-        self.updateSelection()
 
     def onSendRewards(self):
         self.dest_addr = self.ui.destinationLine.text().strip()
@@ -266,6 +320,9 @@ class TabRewards:
             printDbg("Unable to connect to hardware device. The device status is: %d" % self.caller.hwStatus)
             return None
 
+        # Resolve the selected rewards
+        self.selectedRewards = self.getSelection()
+
         # SEND
         self.SendRewards()
 
@@ -351,8 +408,7 @@ class TabRewards:
             printException(getCallerName(), getFunctionName(), err_msg, e.args)
 
     def removeSpentRewards(self):
-        for utxo in self.selectedRewards:
-            self.caller.parent.db.deleteReward(utxo['txid'], utxo['vout'])
+        self.caller.parent.db.deleteRewards(self.selectedRewards)
 
     # Activated by signal sigTxdone from hwdevice
     def FinishSend(self, serialized_tx, amount_to_send):
@@ -399,6 +455,8 @@ class TabRewards:
                         mess2.exec_()
                         # remove spent rewards from DB
                         self.removeSpentRewards()
+                        # balances and utxos cached from the explorer are stale now
+                        self.caller.apiClient.invalidateCache()
                         # reload utxos
                         self.display_utxos()
                         self.onCancel()
@@ -426,22 +484,17 @@ class TabRewards:
         self.ui.loadingLinePercent.setValue(percent)
         QApplication.processEvents()
 
-    def updateSelection(self, clicked_item=None):
-        total = 0
-        self.selectedRewards = self.getSelection()
-        numOfInputs = len(self.selectedRewards)
+    def updateSelection(self):
+        numOfInputs = len(self.selection)
         if numOfInputs:
-            for i in range(0, numOfInputs):
-                total += int(self.selectedRewards[i].get('satoshis'))
-
             # update suggested fee and selected rewards
             estimatedTxSize = (44 + numOfInputs * 148) * 1.0 / 1000  # kB
-            feePerKb = self.caller.rpcClient.getFeePerKb()
+            feePerKb = self.caller.getFeePerKb()
             self.suggestedFee = round(feePerKb * estimatedTxSize, 8)
             printDbg("estimatedTxSize is %s kB" % str(estimatedTxSize))
             printDbg("suggested fee is %s PIV (%s PIV/kB)" % (str(self.suggestedFee), str(feePerKb)))
 
-            self.ui.selectedRewardsLine.setText(str(round(total / 1e8, 8)))
+            self.ui.selectedRewardsLine.setText(str(round(self.selectionTotal / 1e8, 8)))
 
         else:
             self.ui.selectedRewardsLine.setText("")
@@ -19,7 +19,7 @@ from trezorlib.ui import PIN_CURRENT, PIN_NEW, PIN_CONFIRM
 from constants import MPATH_TREZOR as MPATH, MPATH_TESTNET, HW_devices
 from misc import getCallerName, getFunctionName, printException, printDbg, \
     DisconnectedException, printOK, splitString
-from pivx_parser import ParseTx
+from pivx_parser import GetParsedTx
 from threads import ThreadFuns
 from txCache import TxCache
 
@@ -158,7 +158,7 @@ class TrezorApi(QObject):
                 prev_hash = bytes.fromhex(utxo["txid"])
                 if prev_hash not in txes:
                     raw_tx = TxCache(self.main_wnd)[utxo['txid']]
-                    json_tx = ParseTx(raw_tx)
+                    json_tx = GetParsedTx(raw_tx, utxo['txid'])
                     txes[prev_hash] = self.json_to_tx(json_tx)
 
                 # completion percent emitted
@@ -256,6 +256,14 @@ class TrezorApi(QObject):
 
         return curr_addr
 
+    @process_trezor_exceptions
+    def getAccountNode(self, account, isTestnet=False):
+        curr_path = parse_path((MPATH_TESTNET if isTestnet else MPATH) + "%d'" % account)
+        with self.lock:
+            result = btc.get_public_node(self.client, curr_path)
+
+        return result.node.public_key, result.node.chain_code
+
     @process_trezor_exceptions
     def scanForPubKey(self, account, spath, isTestnet=False):
         hwpath = "%d'/0/%d" % (account, spath)
@@ -35,3 +35,28 @@ class TxCache():
             rawtx = rawtx['rawtx']
 
         return rawtx
+
+    '''
+    fetches many rawtxes at once: reads the database with a single query and gets the missing
+    ones from rpc with batch requests (then updates the database in a single transaction).
+    returns a dictionary txid -> rawtx (None if not found)
+    '''
+    def prefetch(self, txids):
+        txids = list(dict.fromkeys(txids))
+        rawtxes = {tx['txid']: tx['rawtx'] for tx in self.main_wnd.parent.db.getRawTxes(txids)}
+        missing = [txid for txid in txids if txid not in rawtxes]
+        if len(missing) > 0:
+            # double check that the rpc connection is still active, else reconnect
+            if self.main_wnd.rpcClient is None:
+                self.main_wnd.updateRPCstatus(None)
+
+            fetched = self.main_wnd.rpcClient.getRawTransactions(missing)
+
+            # update DB
+            if fetched is not None:
+                lastfetch = time()
+                self.main_wnd.parent.db.addRawTxes([(txid, rawtx, lastfetch)
+                                                    for txid, rawtx in fetched.items() if rawtx is not None])
+                rawtxes.update(fetched)
+
+        return rawtxes
@@ -6,11 +6,11 @@
 
 import base64
 from bitcoin import bin_hash160, b58check_to_hex, ecdsa_raw_sign, ecdsa_raw_verify, privkey_to_pubkey, \
-    encode_sig, decode_sig, dbl_sha256, bin_dbl_sha256, ecdsa_raw_recover, encode_pubkey
+    encode_sig, decode_sig, dbl_sha256, ecdsa_raw_recover, encode_pubkey
 from ipaddress import ip_address
 
 from misc import getCallerName, getFunctionName, printException
-from pivx_b58 import b58decode
+from pivx_b58 import b58check_verify
 from pivx_hashlib import wif_to_privkey, pubkey_to_address
 
 # Bitcoin opcodes used in the application
@@ -42,12 +42,7 @@ def checkPivxAddr(address, isTestnet=False):
             return False
 
         # decode and verify checksum
-        addr_bin = bytes.fromhex(b58decode(address).hex())
-        addr_bin_check = bin_dbl_sha256(addr_bin[0:-4])[0:4]
-        if addr_bin[-4:] != addr_bin_check:
-            return False
-
-        return True
+        return b58check_verify(address)
     except Exception:
         return False
 
@@ -4,12 +4,25 @@
 # Distributed under the MIT software license, see the accompanying
 # file LICENSE.txt or http://www.opensource.org/licenses/mit-license.php.
 
-from time import sleep
-from threading import Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import time
+from threading import Event, Lock
 
+from bitcoinrpc.authproxy import JSONRPCException
 from PyQt5.Qt import QObject
 
-from misc import printOK
+from constants import RPC_PROBE_INTERVAL, RPC_PROBE_WORKERS, RPC_PROBE_SAMPLES, RPC_SWITCH_MARGIN, \
+    BLOCK_WAIT_TIMEOUT, BLOCK_POLL_INTERVAL, RPC_WATCHED_INTERVAL
+from misc import printOK, printDbg
+from rpcClient import RpcClient
+
+# optional: block notifications from the local wallet
+try:
+    import zmq
+except ImportError:
+    zmq = None
 
 
 class CtrlObject(object):
@@ -17,13 +30,17 @@ class CtrlObject(object):
 
 
 class RpcWatchdog(QObject):
-    def __init__(self, control_tab, timer_off=10, timer_on=120, *args, **kwargs):
+    def __init__(self, control_tab, timer_off=10, timer_on=120, blockWatcher=None,
+                 timer_watched=RPC_WATCHED_INTERVAL, *args, **kwargs):
         QObject.__init__(self, *args, **kwargs)
         self.firstLoop = True
         self.shutdown_flag = Event()
         self.control_tab = control_tab
         self.timer_off = timer_off  # delay when not connected
         self.timer_on = timer_on  # delay when connected
+        # new blocks already trigger a status update: check much less often while they are watched
+        self.blockWatcher = blockWatcher
+        self.timer_watched = timer_watched  # delay when connected and the block watcher is active
         self.ctrl_obj = CtrlObject()
         self.ctrl_obj.finish = False
 
@@ -33,9 +50,243 @@ class RpcWatchdog(QObject):
             self.control_tab.updateRPCstatus(self.ctrl_obj, False)
 
             if not self.control_tab.rpcConnected:
-                sleep(self.timer_off)
+                self.shutdown_flag.wait(self.timer_off)
+
+            elif self.blockWatcher is not None and self.blockWatcher.watching.is_set():
+                # woken up early if the block watcher fails
+                self.blockWatcher.failed.wait(self.timer_watched)
+                self.blockWatcher.failed.clear()
 
             else:
-                sleep(self.timer_on)
+                self.shutdown_flag.wait(self.timer_on)
 
         printOK("Exiting Rpc Watchdog Thread")
+
+
+class RpcProber(QObject):
+    """
+    Measures, concurrently, the status batch latency and sync status of all the configured RPC servers.
+    Emits main_wnd.sig_RPCprobed after each round.
+    Probes only while active (auto-selection enabled, or RPC servers dialog open): see setActive.
+    """
+    def __init__(self, main_wnd, interval=RPC_PROBE_INTERVAL, *args, **kwargs):
+        QObject.__init__(self, *args, **kwargs)
+        self.shutdown_flag = Event()
+        self.main_wnd = main_wnd
+        self.interval = interval
+        self.active = Event()
+        self.wakeup = Event()
+        self.lock = Lock()
+        # (isCustom, id) --> rolling stats of the server
+        self.stats = {}
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            self.wakeup.clear()
+            if self.active.is_set():
+                self.probeAll()
+            self.wakeup.wait(self.interval)
+
+        printOK("Exiting Rpc Prober Thread")
+
+    def setActive(self, active):
+        if active and not self.active.is_set():
+            printDbg("RPC prober: started")
+            self.active.set()
+            # probe right away
+            self.wakeup.set()
+        elif not active and self.active.is_set():
+            printDbg("RPC prober: stopped")
+            self.active.clear()
+
+    def probeAll(self):
+        servers = list(self.main_wnd.rpcServersList)
+        with ThreadPoolExecutor(max_workers=RPC_PROBE_WORKERS) as pool:
+            results = list(pool.map(self.probe, servers))
+        with self.lock:
+            for server, res in zip(servers, results):
+                self.addSample(server, res)
+        self.main_wnd.sig_RPCprobed.emit()
+
+    def probe(self, server):
+        # undecorated batch call: unreachable servers are expected here and must not flood the log
+        try:
+            client = RpcClient(server['protocol'], server['host'], server['user'], server['password'])
+            try:
+                isTestnet, blocks, synced, latency = client.getStatusCalls()
+            finally:
+                client.close()
+        except Exception as e:
+            printDbg("RPC probe of %s failed: %s" % (server['host'], str(e)))
+            return None
+        return {'latency': latency, 'blocks': blocks, 'isTestnet': isTestnet, 'synced': bool(synced)}
+
+    def addSample(self, server, res):
+        key = (server['isCustom'], server['id'])
+        if key not in self.stats:
+            self.stats[key] = {'latencies': deque(maxlen=RPC_PROBE_SAMPLES),
+                               'results': deque(maxlen=RPC_PROBE_SAMPLES)}
+        stats = self.stats[key]
+        stats['results'].append(res is not None)
+        stats['online'] = res is not None
+        stats['lastProbe'] = time()
+        if res is not None:
+            stats['latencies'].append(res['latency'])
+            stats['blocks'] = res['blocks']
+            stats['isTestnet'] = res['isTestnet']
+            stats['synced'] = res['synced']
+
+    def getStats(self, server):
+        '''
+        returns None (never probed) or a dict with online, latency (median), blocks, synced, isTestnet, uptime
+        '''
+        with self.lock:
+            stats = self.stats.get((server['isCustom'], server['id']))
+            if stats is None:
+                return None
+            res = {'online': stats['online'],
+                   'latency': median(stats['latencies']) if len(stats['latencies']) > 0 else None,
+                   'blocks': stats.get('blocks', 0),
+                   'synced': stats.get('synced', False),
+                   'isTestnet': stats.get('isTestnet'),
+                   'uptime': sum(stats['results']) / len(stats['results'])}
+        return res
+
+    def getFastestServer(self, isTestnet, current=None):
+        '''
+        returns the online and synced server (on the given network) with the lowest latency.
+        The current server is kept, unless another one is RPC_SWITCH_MARGIN times faster.
+        '''
+        candidates = []
+        for server in list(self.main_wnd.rpcServersList):
+            stats = self.getStats(server)
+            if stats is not None and stats['online'] and stats['synced'] and stats['isTestnet'] == isTestnet:
+                candidates.append((server, stats))
+        if len(candidates) == 0:
+            return None
+        # exclude servers lagging behind the tip
+        tip = max(stats['blocks'] for _, stats in candidates)
+        candidates = [c for c in candidates if c[1]['blocks'] >= tip - 1]
+        best = min(candidates, key=lambda c: c[1]['latency'])
+        for server, stats in candidates:
+            if server == current and stats['latency'] <= best[1]['latency'] * RPC_SWITCH_MARGIN:
+                return current
+        return best[0]
+
+
+class BlockWatcher(QObject):
+    """
+    Waits for new blocks on the selected RPC server and emits main_wnd.sig_newBlock(height).
+    Uses, in order of preference: hashblock ZMQ notifications (local wallet publishing them, with pyzmq
+    installed), waitfornewblock long-polling, plain getblockcount polling.
+    A separate RpcClient is used, as long-polling holds its connection.
+    The selected server is read from main_wnd.selectedRPCserver (set on the GUI thread).
+    watching is set once a notification or a long-poll has returned (cleared when falling back to
+    plain polling, or on failure). failed is set on failure (to wake up the RpcWatchdog).
+    """
+    def __init__(self, main_wnd, *args, **kwargs):
+        QObject.__init__(self, *args, **kwargs)
+        self.shutdown_flag = Event()
+        self.main_wnd = main_wnd
+        self.rpcClient = None
+        self.zmqSocket = None
+        self.zmqChecked = False
+        self.canLongPoll = True
+        self.lastBlock = None
+        self.watching = Event()
+        self.failed = Event()
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            try:
+                self.waitForBlock()
+            except Exception as e:
+                printDbg("Block watcher: %s" % str(e))
+                self.watching.clear()
+                self.failed.set()
+                if self.rpcClient is not None:
+                    self.rpcClient.close()
+                self.shutdown_flag.wait(BLOCK_POLL_INTERVAL)
+
+        self.closeZmq()
+        printOK("Exiting Block Watcher Thread")
+
+    def closeZmq(self):
+        if self.zmqSocket is not None:
+            self.zmqSocket.close()
+            self.zmqSocket = None
+
+    def setServer(self, server):
+        self.closeZmq()
+        # the socket timeout must outlast a long-poll
+        self.rpcClient = RpcClient(server['protocol'], server['host'], server['user'], server['password'],
+                                   timeout=BLOCK_WAIT_TIMEOUT + 30)
+        self.zmqChecked = False
+        self.canLongPoll = True
+        self.lastBlock = None
+        self.watching.clear()
+
+    def setupZmq(self, server):
+        # ZMQ notifications only from the local wallet, and only if it actually publishes them
+        # (a SUB socket connects to a closed port without errors)
+        if zmq is None or not server['isCustom'] or server['id'] != 0:
+            return
+        try:
+            with self.rpcClient.lock:
+                notifications = self.rpcClient.conn.getzmqnotifications()
+        except JSONRPCException as e:
+            printDbg("Block watcher: zmq notifications not available (%s)" % str(e))
+            return
+        endpoints = [n['address'] for n in notifications if n.get('type') == "pubhashblock"]
+        if len(endpoints) == 0:
+            printDbg("Block watcher: the wallet doesn't publish hashblock notifications")
+            return
+        # the wallet might be bound to all the interfaces
+        host = server['host'].split(':')[0]
+        endpoint = endpoints[0].replace("0.0.0.0", host).replace("*", host)
+        printDbg("Block watcher: subscribing to %s" % endpoint)
+        self.zmqSocket = zmq.Context.instance().socket(zmq.SUB)
+        self.zmqSocket.setsockopt(zmq.LINGER, 0)
+        self.zmqSocket.setsockopt(zmq.SUBSCRIBE, b"hashblock")
+        self.zmqSocket.connect(endpoint)
+
+    def waitForBlock(self):
+        server = self.main_wnd.selectedRPCserver
+        if server is None:
+            self.watching.clear()
+            self.shutdown_flag.wait(BLOCK_POLL_INTERVAL)
+            return
+        if self.rpcClient is None or self.rpcClient.rpc_url != RpcClient.getUrl(
+                server['protocol'], server['host'], server['user'], server['password']):
+            self.setServer(server)
+        if not self.zmqChecked:
+            self.setupZmq(server)
+            self.zmqChecked = True
+
+        if self.lastBlock is not None:
+            if self.zmqSocket is not None:
+                # wait for a notification. The timeout bounds the time needed to notice that the wallet is gone
+                if self.zmqSocket.poll(BLOCK_POLL_INTERVAL * 1000):
+                    while self.zmqSocket.poll(0):
+                        self.zmqSocket.recv_multipart()
+                    self.watching.set()
+            elif self.canLongPoll:
+                try:
+                    with self.rpcClient.lock:
+                        self.rpcClient.conn.waitfornewblock(BLOCK_WAIT_TIMEOUT * 1000)
+                    self.watching.set()
+                except JSONRPCException as e:
+                    printDbg("Block watcher: long-polling not available (%s). Polling." % str(e))
+                    self.canLongPoll = False
+            else:
+                # plain polling is no better than the RpcWatchdog: don't slow it down
+                self.watching.clear()
+                self.shutdown_flag.wait(BLOCK_POLL_INTERVAL)
+
+        with self.rpcClient.lock:
+            n = self.rpcClient.conn.getblockcount()
+        if n != self.lastBlock:
+            if self.lastBlock is not None:
+                printDbg("New block: %d" % n)
+                self.main_wnd.sig_newBlock.emit(n)
+            self.lastBlock = n